@@ -21,15 +21,22 @@ def slice_names_100(name):
     return cut_title
 
 
+translate_table = str.maketrans('', '', '\'",-.!/():')
+
+
+# the words of each item, lowercased with punctuation removed, so searching doesn't have to redo that every keystroke
+def build_search_index(strs_to_search: tuple) -> tuple:
+    return tuple((item, tuple(item[0].translate(translate_table).lower().split(' '))) for item in strs_to_search)
+
+
+def search_index(current_str: str, index: tuple) -> list:
+    current_words = current_str.translate(translate_table).lower().split(' ')
+    return [item for item, words in index
+            if all([any([string1 in string2 for string2 in words]) for string1 in current_words])]
+
+
 def search_list(current_str: str, strs_to_search: tuple):
-    translate_table = str.maketrans('', '', '\'",-.!/():')
-    current_words = current_str.translate(translate_table).split(' ')
-    return_list = list()
-    for item in strs_to_search:
-        tuple_to_search = tuple(item[0].translate(translate_table).split(' '))
-        if all([any([string1.lower() in string2.lower() for string2 in tuple_to_search]) for string1 in current_words]):
-            return_list.append(item)
-    return return_list
+    return search_index(current_str, build_search_index(strs_to_search))
 
 
 def format_time(total_seconds):
@@ -74,42 +81,108 @@ async def get_game(interaction: discord.Interaction, current: str) -> list[Choic
             for game in src.get_game(name=current).get('data')][:25]
 
 
-# since this function requires access to the master table, we wrap the function and return the autocomplete function
-def get_run(master_table: tables.MasterTable):
-    async def get_run_inner(interaction: discord.Interaction, current: str) -> list[Choice[str]]:
+# autocomplete lists only change when the tables get synced, so they're built once and kept until clear_caches
+cache = {}
+
+
+# keys only clears those caches (like 'runs'), otherwise everything goes
+def clear_caches(*keys):
+    if not keys:
+        cache.clear()
+    for key in keys:
+        cache.pop(key, None)
+
+
+# search index of every run for get_run
+def get_run_choices(master_table: tables.MasterTable) -> tuple:
+    if 'runs' not in cache:
         selected_cols = ['run_id', 'game_name', 'player_name', 'igt', 'category_name', 'variable_info']
         rows = tuple((f'''{row.get('game_name')}: {row.get('category_name')} by {row.get('player_name')} in {format_time(row.get('igt'))} ({' '.join(row.get('variable_info').values())})''', row.get('run_id'))
                      for row in master_table.select_row_col(cols=selected_cols))
-        filtered_rows = search_list(current, rows)
+        cache['runs'] = build_search_index(rows)
+    return cache['runs']
+
+
+# since this function requires access to the master table, we wrap the function and return the autocomplete function.
+# the tables are only made once the bot starts, so this takes a function that returns the table instead of the table
+def get_run(get_master_table):
+    async def get_run_inner(interaction: discord.Interaction, current: str) -> list[Choice[str]]:
+        filtered_rows = search_index(current, get_run_choices(get_master_table()))
         return [Choice(name=row[0], value=row[1]) for row in filtered_rows][:25]
 
     return get_run_inner
 
 
-def get_categories(variable_table: tables.VariableTable):
-    async def get_categories_inner(interaction: discord.Interaction, current: str) -> list[Choice[str]]:
-        rows = variable_table(
-            '''SELECT var_name, variable_id, var_values, categories.category_id, categories.name, categories.game_id FROM variables JOIN categories ON variables.category_id = categories.category_id''')
-        categories_dict = {}
-        for row in rows:
-            category_id = row.get('category_id')
-            categories_dict.setdefault(category_id, {}).update({
-                row['var_name']: tuple(row['var_values'].values()),
-                'game_id': row['game_id'],
-                'category_name': row['name']
+# search index of every runner for get_runner
+def get_runner_choices(user_table: tables.UserTable) -> tuple:
+    if 'runners' not in cache:
+        rows = tuple((row.get('user_name'), row.get('user_id'))
+                     for row in user_table.select_row_col(cols=['user_id', 'user_name']) if row.get('user_name'))
+        cache['runners'] = build_search_index(rows)
+    return cache['runners']
+
+
+# same as get_run, this takes a function that returns the user table
+def get_runner(get_user_table):
+    async def get_runner_inner(interaction: discord.Interaction, current: str) -> list[Choice[str]]:
+        filtered_rows = search_index(current, get_runner_choices(get_user_table()))
+        return [Choice(name=slice_names_100(row[0]), value=row[1]) for row in filtered_rows][:25]
+
+    return get_runner_inner
+
+
+# every game - category - subcategory combination we know about. variables is {variable_id: value_id} for the combo
+# (what the leaderboard endpoint filters on), and labels are the names of those values.
+# only variables that are subcategories split a leaderboard, and a category without any is one combo with no variables.
+# is_subcategory is empty in a db from before it was stored, those variables are counted as subcategories
+def get_category_combos(variable_table: tables.VariableTable) -> list:
+    if 'combos' in cache:
+        return cache['combos']
+    rows = variable_table(
+        '''SELECT variable_id, var_values, categories.category_id, categories.name, categories.game_id, categories.category_type FROM categories LEFT JOIN variables ON variables.category_id = categories.category_id AND variables.is_subcategory IS NOT 0''')
+    categories_dict = {}
+    for row in rows:
+        category_id = row.get('category_id')
+        variables = categories_dict.setdefault(category_id, {
+            'game_id': row['game_id'],
+            'category_name': row['name'],
+            'category_type': row['category_type'],
+            'variables': {}
+        })['variables']
+        if row['variable_id']:
+            variables.update({row['variable_id']: tuple(row['var_values'].items())})
+    combos = []
+    for category_id, values in categories_dict.items():
+        game_id = values.get('game_id')
+        variable_ids = tuple(values.get('variables'))
+        for combo in product(*values.get('variables').values()):
+            combos.append({
+                'game_id': game_id,
+                'game_name': GAMES.get(game_id),
+                'category_id': category_id,
+                'category_name': values.get('category_name'),
+                'category_type': values.get('category_type'),
+                'variables': {variable_id: value_id for variable_id, (value_id, label) in zip(variable_ids, combo)},
+                'labels': tuple(label for value_id, label in combo)
             })
-        initial_list = []
-        for values in categories_dict.values():
-            game_id = values.pop('game_id')
-            game_name = GAMES.get(game_id)
-            category_name = values.pop('category_name')
-            all_combos = list(product(*tuple(values.values())))
+    cache['combos'] = combos
+    return combos
 
-            initial_list.extend([(f'''{game_name} - {category_name} ({', '.join(combo)})''',
-                                  dumps([game_name, category_name, combo])) for combo in all_combos])
 
-        filtered_list = search_list(current, tuple(initial_list))
+# (name, value) of every combo for get_categories, as a search index
+def get_category_choices(variable_table: tables.VariableTable) -> tuple:
+    if 'categories' not in cache:
+        cache['categories'] = build_search_index(tuple(
+            (f'''{combo['game_name']} - {combo['category_name']}''' + (f''' ({', '.join(combo['labels'])})''' if combo['labels'] else ''),
+             dumps([combo['game_name'], combo['category_name'], combo['labels']]))
+            for combo in get_category_combos(variable_table)))
+    return cache['categories']
+
+
+# same as get_run, this takes a function that returns the variable table
+def get_categories(get_variable_table):
+    async def get_categories_inner(interaction: discord.Interaction, current: str) -> list[Choice[str]]:
+        filtered_list = search_index(current, get_category_choices(get_variable_table()))
         return [Choice(name=value1, value=value2) for value1, value2 in filtered_list][:25]
 
     return get_categories_inner
-
@@ -4,3 +4,36 @@ HEADER = {"User-Agent": "SpeedrunBot for Discord by rubiks37 (Contact on Discord
 TOKEN = 'YOUR_BOT_TOKEN'
 GAMES = {'GAME1_id': 'GAME1_name', 'GAME2_id': 'GAME2_name'}  # and so on
 
+
+# optional: how many processes parse runs during a parallel full resync (None is one per core),
+# and how many parsed rows get written to the db at a time
+PARSE_WORKERS = None
+PARSE_BATCH_SIZE = 1000
+
+# optional: how many places of each leaderboard get refreshed, and how often (in seconds)
+LEADERBOARD_TOP = 10
+LEADERBOARD_INTERVAL = 300
+# optional: seconds between leaderboard requests, speedrun.com allows about 100 requests a minute
+LEADERBOARD_REQUEST_DELAY = 1
+
+# optional: keep an in memory copy of runs.db for commands and autocomplete. turn off to save memory
+MEMORY_REPLICA = True
+
+# optional: where /export saves files that are too big to upload to discord
+EXPORT_DIR = 'exports'
+
+# optional: how many long running commands (resyncs, exports) can run at the same time
+MAX_RUNNING_JOBS = 2
+
+# optional: channel id to post new runs, status changes and new wrs to (leave as None for no notifications),
+# how often to check for them (in seconds), and how many messages to post per check at most
+NOTIFY_CHANNEL_ID = None
+NOTIFY_INTERVAL = 60
+NOTIFY_MAX_MESSAGES = 5
+
+# optional: memory budget in MB, caches get thrown out (and rebuilt when needed) if they and the in memory copy of
+# the db (see MEMORY_REPLICA) take up more than this (None is no budget), how often memory is checked (in seconds), and whether to trace allocations for /memory
+# (tracing makes the bot slower and use more memory)
+MEMORY_BUDGET_MB = None
+MEMORY_SAMPLE_INTERVAL = 60
+MEMORY_TRACE = False
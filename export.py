@@ -0,0 +1,141 @@
+# streams runs out of runs_master into a csv, json lines or parquet file, FETCH_SIZE rows at a time,
+# so exporting never holds the whole table in memory. used by /export, and can be run on its own:
+# python export.py runs.csv --format csv --gzip --game "Game Name" --date "Year 2023"
+
+import argparse
+import csv
+import datetime
+import gzip
+import os
+import sqlite3
+from json import dumps, loads
+import tables
+import where
+from where import WhereCond
+
+FETCH_SIZE = 1000
+FORMATS = ('csv', 'jsonl', 'parquet')
+# discord's upload limit for servers without boosts
+DEFAULT_UPLOAD_LIMIT = 8 * 1024 * 1024
+# declared types that are stored as text but aren't plain strings. json and users are decoded for json lines
+TEXT_TYPES = ('date', 'users', 'json')
+JSON_TYPES = ('users', 'json')
+
+
+# reading the custom types as text means none of the converters run, so the connection doesn't need them registered
+def get_export_cols(master_table: tables.MasterTable) -> list:
+    return [f'CAST({col} AS TEXT) AS {col}' if col_type in TEXT_TYPES else col
+            for col, col_type in zip(master_table.COLS, master_table.COL_TYPES)]
+
+
+# yields lists of up to fetch_size rows (as tuples in the same order as master_table.COLS)
+def stream_rows(master_table: tables.MasterTable, where_conds: list = None, fetch_size: int = FETCH_SIZE):
+    query, params = where.build_select(master_table.NAME, get_export_cols(master_table), where_conds)
+    cursor = master_table.conn.cursor()
+    cursor.row_factory = None
+    try:
+        cursor.execute(query, params)
+        while rows := cursor.fetchmany(fetch_size):
+            yield rows
+    finally:
+        cursor.close()
+
+
+def report_batches(batches, progress):
+    for rows in batches:
+        yield rows
+        progress(rows=len(rows))
+
+
+def write_csv(file, cols: tuple, batches):
+    writer = csv.writer(file)
+    writer.writerow(cols)
+    for rows in batches:
+        writer.writerows(rows)
+
+
+def write_jsonl(file, cols: tuple, col_types: tuple, batches):
+    json_cols = {col for col, col_type in zip(cols, col_types) if col_type in JSON_TYPES}
+    for rows in batches:
+        for row in rows:
+            record = {col: loads(value) if col in json_cols and value else value for col, value in zip(cols, row)}
+            file.write(dumps(record) + '\n')
+
+
+# pyarrow is only needed for parquet, so it's only imported if someone asks for parquet
+def write_parquet(path: str, cols: tuple, col_types: tuple, batches, compress: bool):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError('error: pyarrow has to be installed to export parquet')
+    schema = pyarrow.schema([(col, pyarrow.float64() if col_type == 'REAL' else pyarrow.string())
+                             for col, col_type in zip(cols, col_types)])
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='gzip' if compress else 'snappy') as writer:
+        for rows in batches:
+            columns = {col: list(values) for col, values in zip(cols, zip(*rows))}
+            writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+
+
+# writes every run matching where_conds to path and returns the path it was written to
+# (.gz gets added for compressed csv/jsonl, parquet is compressed inside the file instead)
+# progress (like jobs.Job.add) gets called with rows= after every batch.
+# if the export fails or gets cancelled partway, the half written file is deleted
+def export_runs(db_path: str, path: str, file_format: str = 'csv', compress: bool = False, where_conds: list = None,
+                progress=None) -> str:
+    if file_format not in FORMATS:
+        raise ValueError(f'''error: format has to be one of {', '.join(FORMATS)}''')
+    if file_format != 'parquet' and compress:
+        path = path + '.gz'
+    conn = sqlite3.connect(db_path)
+    rows = None
+    try:
+        master_table = tables.MasterTable(conn)
+        cols, col_types = master_table.COLS, master_table.COL_TYPES
+        batches = rows = stream_rows(master_table, where_conds)
+        if progress:
+            batches = report_batches(batches, progress)
+        if file_format == 'parquet':
+            write_parquet(path, cols, col_types, batches, compress)
+            return path
+        opener = gzip.open if compress else open
+        with opener(path, 'wt', newline='', encoding='utf-8') as file:
+            if file_format == 'csv':
+                write_csv(file, cols, batches)
+            else:
+                write_jsonl(file, cols, col_types, batches)
+        return path
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    finally:
+        # a cancelled export leaves the cursor open inside the generator, it has to be closed before the connection
+        if rows:
+            rows.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='export the cached runs in runs.db')
+    parser.add_argument('output', help='file to write to')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--gzip', action='store_true', help='compress the output')
+    parser.add_argument('--db', default='runs.db', help='path to the runs db')
+    parser.add_argument('--game', help='only runs of this game (by name)')
+    parser.add_argument('--category', help='only runs of this category (by name)')
+    parser.add_argument('--status', help='only runs with this status (new, verified or rejected)')
+    parser.add_argument('--date', help='only runs in this date range, like "After 2023-01-01" or "Last 3 Months"')
+    args = parser.parse_args()
+
+    sqlite3.register_adapter(datetime.date, tables.adapt_date_iso)
+    where_conds = [WhereCond(col, '=', value)
+                   for col, value in (('game_name', args.game), ('category_name', args.category), ('status', args.status))
+                   if value]
+    if args.date:
+        where_conds.extend(where.create_where_conditions_from_date_str(args.date))
+    print(export_runs(args.db, args.output, args.format, args.gzip, where_conds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# long running commands (resyncs, exports...) go through here so they don't time out the interaction or hold up
+# everyone else. each one defers its interaction, runs as a background task (at most max_running at a time), and
+# keeps a progress message up to date until it's done
+
+import asyncio
+from datetime import timedelta
+from time import perf_counter
+from traceback import print_exc
+import discord
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id: int, name: str, user: str):
+        self.id = job_id
+        self.name = name
+        self.user = user
+        self.status = 'queued'
+        self.started = None
+        self.cancelled = False
+        self.task = None
+        # counters shown in the progress message, like pages and rows. total is the number of rows expected, if known
+        self.progress = {}
+        self.total = None
+
+    # the work calls this as it goes (it's fine to call from another thread). this is also where a cancel is noticed,
+    # since work running in a thread can't be cancelled from outside
+    def add(self, **counts):
+        if self.cancelled:
+            raise JobCancelled()
+        for key, value in counts.items():
+            self.progress[key] = self.progress.get(key, 0) + value
+
+    def eta(self) -> timedelta or None:
+        rows = self.progress.get('rows', 0)
+        if not self.total or not rows or not self.started:
+            return None
+        elapsed = perf_counter() - self.started
+        return timedelta(seconds=round(max(self.total - rows, 0) * elapsed / rows))
+
+    # add can put new counters in progress from a thread while this runs, so it goes over a copy
+    def __str__(self):
+        counts = ', '.join(f'''{key.replace('_', ' ')}: {value}''' for key, value in self.progress.copy().items())
+        eta = self.eta()
+        parts = [f'**{self.name}** (job {self.id}, started by {self.user}): {self.status}', counts,
+                 f'ETA {eta}' if eta is not None and self.status == 'running' else '']
+        return ' - '.join(part for part in parts if part)
+
+
+class JobRunner:
+    def __init__(self, max_running: int = 2, update_interval: float = 5):
+        self.semaphore = asyncio.Semaphore(max_running)
+        self.update_interval = update_interval
+        self.jobs = {}
+        self.next_id = 1
+
+    # work is an async function that takes the job and returns kwargs for interaction.followup.send (or None).
+    # the interaction has to not have been responded to yet
+    async def start(self, interaction: discord.Interaction, name: str, work) -> Job:
+        await interaction.response.defer()
+        job = Job(self.next_id, name, interaction.user.display_name)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        message = await interaction.followup.send(content=str(job), wait=True)
+        job.task = asyncio.create_task(self.run(job, work, interaction, message))
+        return job
+
+    async def run(self, job: Job, work, interaction: discord.Interaction, message: discord.WebhookMessage):
+        result = None
+        try:
+            async with self.semaphore:
+                job.status = 'running'
+                job.started = perf_counter()
+                updater = asyncio.create_task(self.keep_updated(job, message))
+                try:
+                    result = await work(job)
+                    job.status = f'done in {timedelta(seconds=round(perf_counter() - job.started))}'
+                finally:
+                    updater.cancel()
+        except (JobCancelled, asyncio.CancelledError):
+            job.status = 'cancelled'
+        except Exception as error:
+            print_exc()
+            job.status = f'failed: {error}'
+        finally:
+            self.jobs.pop(job.id, None)
+        await self.edit(message, job)
+        if result:
+            try:
+                await interaction.followup.send(**result)
+            except discord.HTTPException:
+                print_exc()
+
+    async def keep_updated(self, job: Job, message: discord.WebhookMessage):
+        while True:
+            await asyncio.sleep(self.update_interval)
+            await self.edit(message, job)
+
+    # interaction tokens only last 15 minutes, after that the progress message can't be edited anymore.
+    # that shouldn't stop the job though
+    @staticmethod
+    async def edit(message: discord.WebhookMessage, job: Job):
+        try:
+            await message.edit(content=str(job))
+        except discord.HTTPException:
+            pass
+
+    # returns False if there's no job with that id
+    def cancel(self, job_id: int) -> bool:
+        job = self.jobs.get(job_id)
+        if not job:
+            return False
+        job.cancelled = True
+        if job.status == 'queued':
+            job.task.cancel()
+        return True
+
+    def list_jobs(self) -> list:
+        return list(self.jobs.values())
@@ -1,3 +1,7 @@
+# so we can report how long importing and starting up takes, this has to come before the other imports
+from time import perf_counter
+start_time = perf_counter()
+
 import discord
 import datetime
 import sqlite3
@@ -6,11 +10,21 @@ from discord import app_commands
 import config
 import asyncio
 from traceback import print_exc
+from typing import Literal
+import os
+import tracemalloc
 import tables
+import where
 import users
 import speedruncom_integration as src
-from where import WhereCond
+from where import WhereCond, create_where_conditions_from_date_str
 import autocomplete as ac
+import export
+import jobs
+import memory
+import pagination
+import parallel_resync
+from run_store import RunStore
 
 
 # set up all the adapters and converters for the different types of vars used in tables
@@ -20,25 +34,180 @@ sqlite3.register_adapter(dict, dumps)
 sqlite3.register_converter('date', tables.convert_date_iso)
 sqlite3.register_converter('users', tables.convert_users)
 sqlite3.register_converter('json', loads)
-conn = sqlite3.connect('runs.db', detect_types=sqlite3.PARSE_DECLTYPES)
-conn.row_factory = tables.dict_factory
-
-# creates variables table to handle all variables
-variables_table = tables.VariableTable(conn)
-
-# creates categories to handle all categories
-categories_table = tables.CategoryTable(conn)
 
-# creates user table to handle all users
-user_table = tables.UserTable(conn)
+DB_PATH = 'runs.db'
+# where /export writes files that are too big to upload. optional in the config
+EXPORT_DIR = getattr(config, 'EXPORT_DIR', 'exports')
+
+# the db and tables aren't set up until the bot starts (see setup_db), so importing this file stays cheap
+conn = None
+variables_table = None
+categories_table = None
+user_table = None
+master_table = None
+run_players_table = None
+run_changes_table = None
+# in memory copy of runs.db that all the interactive reads (commands and autocomplete) go through, so they don't
+# wait on the disk or on a sync that's writing. it's refreshed with refresh_replica after the disk tables change
+replica_conn = None
+replica_variables_table = None
+replica_master_table = None
+replica_user_table = None
+replica_run_players_table = None
+# optional in the config, turning it off makes the replica tables the same as the disk ones (less memory)
+MEMORY_REPLICA = getattr(config, 'MEMORY_REPLICA', True)
+# numpy copy of runs_master for the stats commands, has to be rebuilt whenever runs_master is resynced
+run_store = RunStore()
+
+# get_wr results by autocomplete value, warmed at startup and cleared whenever the runs change
+wr_cache = {}
+
+# everything that writes to the disk tables happens in a thread (so the bot keeps responding) while holding this,
+# so only one thing writes at a time. the replica and caches are refreshed on the main thread while still holding it
+write_lock = asyncio.Lock()
+# how many long running commands can run at once, optional in the config
+job_runner = jobs.JobRunner(getattr(config, 'MAX_RUNNING_JOBS', 2))
+
+# how many places of each leaderboard to keep fresh, and how often to refresh them (in seconds). both optional
+LEADERBOARD_TOP = getattr(config, 'LEADERBOARD_TOP', 10)
+LEADERBOARD_INTERVAL = getattr(config, 'LEADERBOARD_INTERVAL', 300)
+# channel that new runs, status changes and new wrs get posted to (no notifications if it's not set), how often to
+# check for changes (in seconds), and how many messages to post per check at most. all optional
+NOTIFY_CHANNEL_ID = getattr(config, 'NOTIFY_CHANNEL_ID', None)
+NOTIFY_INTERVAL = getattr(config, 'NOTIFY_INTERVAL', 60)
+NOTIFY_MAX_MESSAGES = getattr(config, 'NOTIFY_MAX_MESSAGES', 5)
+# caches get evicted when they and the replica take up more than MEMORY_BUDGET_MB (no budget if it's not set), checked
+# every MEMORY_SAMPLE_INTERVAL seconds. MEMORY_TRACE turns on tracemalloc for /memory, it costs memory and speed.
+# all optional
+MEMORY_BUDGET_MB = getattr(config, 'MEMORY_BUDGET_MB', None)
+MEMORY_SAMPLE_INTERVAL = getattr(config, 'MEMORY_SAMPLE_INTERVAL', 60)
+MEMORY_TRACE = getattr(config, 'MEMORY_TRACE', False)
+
+
+def setup_db():
+    global conn, variables_table, categories_table, user_table, master_table, run_players_table, run_changes_table
+    # writes are done from threads, but never two at once (see write_lock)
+    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=where.STATEMENT_CACHE_SIZE,
+                           check_same_thread=False)
+    conn.row_factory = tables.dict_factory
+
+    # creates variables table to handle all variables
+    variables_table = tables.VariableTable(conn)
+
+    # creates categories to handle all categories
+    categories_table = tables.CategoryTable(conn)
+
+    # creates user table to handle all users
+    user_table = tables.UserTable(conn)
+
+    # creates master table to combine all tables into one
+    master_table = tables.MasterTable(conn)
+
+    # creates run players table so runners can be looked up without going through runs_master
+    run_players_table = tables.RunPlayersTable(conn)
+    run_players_table.backfill(master_table)
+
+    # creates run changes table, the feed of new runs and status changes the notifier posts from
+    run_changes_table = tables.RunChangesTable(conn)
+    setup_replica()
+    register_caches()
+
+
+def setup_replica():
+    global replica_conn, replica_variables_table, replica_master_table, replica_user_table, replica_run_players_table
+    if not MEMORY_REPLICA:
+        replica_conn, replica_variables_table, replica_master_table = conn, variables_table, master_table
+        replica_user_table, replica_run_players_table = user_table, run_players_table
+        return
+    replica_conn = tables.create_memory_replica(conn, where.STATEMENT_CACHE_SIZE)
+    replica_variables_table = tables.VariableTable(replica_conn)
+    replica_master_table = tables.MasterTable(replica_conn)
+    replica_user_table = tables.UserTable(replica_conn)
+    replica_run_players_table = tables.RunPlayersTable(replica_conn)
+
+
+# everything that can be thrown out when memory runs low, along with the db connections whose page cache gets shrunk
+def register_caches():
+    memory.register('autocomplete', lambda: len(ac.cache), ac.clear_caches, lambda: ac.cache)
+    memory.register('wr', lambda: len(wr_cache), wr_cache.clear, lambda: wr_cache)
+    memory.register('run_store', lambda: len(run_store), run_store.clear, lambda: run_store)
+    memory.register_lru('select_sql', where.build_select_sql)
+    memory.register_lru('date_strs', where.parse_date_str)
+    memory.register_connection('runs.db', conn)
+    if replica_conn is not conn:
+        memory.register_connection('replica', replica_conn)
+
+
+# has to be called after anything writes to the disk tables, or the commands won't see the changes.
+# this copies the whole db, so it's only for after a full resync (see refresh_replica_rows for everything else)
+def refresh_replica():
+    if replica_conn is not conn:
+        conn.commit()
+        conn.backup(replica_conn)
+
+
+# writes the same rows that were just written to the disk tables into the replica, for when only a few runs changed
+def refresh_replica_rows(user_rows: list, master_rows: list, run_players_rows: list):
+    if replica_conn is conn:
+        return
+    with tables.transaction(replica_conn):
+        replica_user_table.upsert_rows(user_rows)
+        replica_master_table.upsert_rows(master_rows)
+        replica_run_players_table.upsert_rows(run_players_rows, key='run_id')
+
+
+# for after the tables change, everything cached from them is out of date
+def clear_caches():
+    ac.clear_caches()
+    wr_cache.clear()
+
+
+# fills the autocomplete and wr caches from the local db so nobody gets the slow path
+def warm_autocomplete():
+    clear_caches()
+    ac.get_run_choices(replica_master_table)
+    ac.get_runner_choices(replica_user_table)
+    for (name, value), words in ac.get_category_choices(replica_variables_table):
+        try:
+            get_wr(value)
+        except Exception:
+            # categories without any verified runs have no wr to cache
+            pass
+
+
+# warms everything, so the first people to use the bot after a restart or resync don't wait on it
+def warm_caches():
+    run_store.rebuild(replica_master_table)
+    warm_autocomplete()
+
+
+class SpeedrunBot(discord.Client):
+    first_interaction = True
+
+    # runs once before the bot connects, so it's not online until the db is set up and the caches are warm
+    async def setup_hook(self):
+        setup_start = perf_counter()
+        setup_db()
+        warm_caches()
+        print(f'set up db and warmed caches in {perf_counter() - setup_start:.2f}s')
+        asyncio.create_task(leaderboard_loop())
+        if NOTIFY_CHANNEL_ID:
+            asyncio.create_task(notify_loop())
+        asyncio.create_task(memory_loop())
+
+    async def on_ready(self):
+        print(f'ready {perf_counter() - start_time:.2f}s after starting')
+
+    async def on_interaction(self, interaction: discord.Interaction):
+        if self.first_interaction:
+            self.first_interaction = False
+            print(f'first interaction {perf_counter() - start_time:.2f}s after starting')
 
-# creates master table to combine all tables into one
-master_table = tables.MasterTable(conn)
 
 intents = discord.Intents.default()
 intents.message_content = True
 allowed_mentions = discord.AllowedMentions.none()
-client = discord.Client(intents=intents, allowed_mentions=allowed_mentions)
+client = SpeedrunBot(intents=intents, allowed_mentions=allowed_mentions)
 tree = app_commands.CommandTree(client)
 
 
@@ -47,18 +216,6 @@ async def sync_commands():
     await tree.sync(guild=await client.fetch_guild(843315943836614676))
 
 
-def split_message(content):
-    if len(content) <= 2000:
-        return [content]
-    fragments = []
-    while len(content) > 2000:
-        cutoff = content[:2000].rfind('\n')
-        fragments.append(content[:cutoff])
-        content = content[cutoff:].lstrip()
-    fragments.append(content)
-    return fragments
-
-
 def resync_variables():
     all_variable_rows = []
     for game_id in config.GAMES:
@@ -87,45 +244,316 @@ def resync_categories():
     return True
 
 
-def resync_master_user():
-    all_runs = []
-    [all_runs.extend(src.get_all_runs_users(game_id)) for game_id in config.GAMES]
-    user_rows = src.parse_runs_into_users_rows(all_runs)
-    user_table.resync_table(user_rows)
-    master_rows = [src.parse_call_into_master_row(run, categories_table, variables_table, user_table) for run in all_runs]
-    master_table.resync_table(master_rows)
-
-
-def resync_all():
-    tables.drop_all_tables(conn)
-    resync_categories()
-    resync_variables()
-    resync_master_user()
-
-
-def get_wr(autocomplete_val: str):
+# parallel parses the runs in a pool of processes (see parallel_resync), which is worth it for big games.
+# job is a jobs.Job to report progress to. has to be called inside a tables.transaction (resync_all does)
+def resync_master_user(parallel: bool = False, job: jobs.Job = None):
+    progress = job.add if job else None
+    parallel_resync.resync_master_user(config.GAMES, categories_table, variables_table, user_table, master_table,
+                                       run_players_table, progress=progress, parallel=parallel)
+
+
+# only writes to the disk tables, use run_resync_all to also bring the replica and caches up to date.
+# every table gets dropped and recreated by its own resync, so the old statuses are still there to snapshot first.
+# it's all one transaction, so cancelling the job or a failed request rolls everything back to how it was
+def resync_all(parallel: bool = False, job: jobs.Job = None):
+    with tables.transaction(conn):
+        run_changes_table.snapshot_statuses(master_table)
+        resync_categories()
+        resync_variables()
+        resync_master_user(parallel, job)
+        run_changes_table.record_changes(master_table, full=True)
+
+
+async def run_resync_all(parallel: bool = False, job: jobs.Job = None):
+    async with write_lock:
+        await asyncio.to_thread(resync_all, parallel, job)
+        refresh_replica()
+        warm_caches()
+
+
+# refreshes just the top runs of every category from the leaderboard endpoints, so the wr and top 10 stay up to date
+# without having to resync every run. the requests are done in a thread so the bot isn't blocked while they run
+async def refresh_leaderboards(top: int = LEADERBOARD_TOP):
+    combos = ac.get_category_combos(replica_variables_table)
+    runs = await asyncio.to_thread(src.get_leaderboard_runs, combos, top)
+    if not runs:
+        return
+    async with write_lock:
+        user_rows, master_rows, run_players_rows = await asyncio.to_thread(write_leaderboard_runs, runs)
+        # most refreshes don't change anything, so there's nothing to copy or rebuild
+        if not master_rows:
+            return
+        refresh_replica_rows(user_rows, master_rows, run_players_rows)
+        run_store.patch(replica_master_table, [row[0] for row in master_rows])
+        refresh_changed_caches(master_rows)
+
+
+# after a few runs were written: the run and runner autocompletes are rebuilt, and only the wrs of the categories
+# those runs are in get thrown out and looked up again
+def refresh_changed_caches(master_rows: list):
+    ac.clear_caches('runs', 'runners')
+    ac.get_run_choices(replica_master_table)
+    ac.get_runner_choices(replica_user_table)
+    # game_name and category_name, see src.parse_call_into_master_row
+    categories = {(row[2], row[11]) for row in master_rows}
+    for autocomplete_val in [value for value in wr_cache if tuple(loads(value)[:2]) in categories]:
+        del wr_cache[autocomplete_val]
+        try:
+            get_wr(autocomplete_val)
+        except Exception:
+            pass
+
+
+# writes the runs from refresh_leaderboards that are new or different from what's in the disk tables,
+# and returns the user, master and run_players rows that were written (nothing is written if nothing changed)
+def write_leaderboard_runs(runs: list) -> tuple:
+    user_rows = src.parse_runs_into_users_rows(runs)
+    lookups = src.get_master_lookups(categories_table, variables_table, user_table, runs)
+    # the players in these runs are newer than what's in the users table, and might not be in it yet
+    lookups['users'].update({row[0]: dict(zip(src.USER_COLS, row)) for row in user_rows})
+    master_rows = [src.parse_call_into_master_row(run, lookups) for run in runs]
+    changed_run_ids = master_table.get_changed_run_ids(master_rows)
+    if not changed_run_ids:
+        return [], [], []
+    master_rows = [row for row in master_rows if row[0] in changed_run_ids]
+    changed_runs = [run for run in runs if run.get('id') in changed_run_ids]
+    # a runner with more than one changed run would otherwise be inserted twice
+    user_rows = list({row[0]: row for row in src.parse_runs_into_users_rows(changed_runs)}.values())
+    run_players_rows = src.parse_master_rows_into_run_players_rows(master_rows)
+    with tables.transaction(conn):
+        user_table.upsert_rows(user_rows)
+        run_changes_table.snapshot_statuses(master_table, [row[0] for row in master_rows])
+        master_table.upsert_rows(master_rows)
+        run_changes_table.record_changes(master_table)
+        run_players_table.upsert_rows(run_players_rows, key='run_id')
+    return user_rows, master_rows, run_players_rows
+
+
+async def leaderboard_loop():
+    while True:
+        try:
+            await refresh_leaderboards()
+        except Exception:
+            print_exc()
+        await asyncio.sleep(LEADERBOARD_INTERVAL)
+
+
+# one line for a row from run_changes
+def format_change(change: dict) -> str:
+    category = change['category_name']
+    # variable values that aren't in the variables table anymore have no label
+    labels = [label for label in (change['variable_info'] or {}).values() if label is not None]
+    if labels:
+        category += f''' ({', '.join(map(str, labels))})'''
+    run = f'''{category} in {ac.format_time(change['igt']) if change['igt'] is not None else 'no time'} by {change['player_name']}'''
+    if change['is_new_wr']:
+        return f'New WR! {run}'
+    if not change['old_status']:
+        return f'''New run: {run} ({change['new_status']})'''
+    return f'''{run}: {change['old_status']} -> {change['new_status']}'''
+
+
+# changes grouped into one post per game, split so no post is over discord's 2000 character limit.
+# returns [(content, change_ids)] so only what actually got posted is marked as notified. a change that can't be
+# formatted is left out but still marked, so one bad row doesn't hold up every post after it (content is None if
+# that's all there was)
+def build_notifications(changes: list, max_length: int = 2000) -> list:
+    games = {}
+    for change in changes:
+        games.setdefault(change['game_name'], []).append(change)
+    posts = []
+    for game, game_changes in games.items():
+        header = f'**{game}**'
+        content, change_ids = header, []
+        for change in game_changes:
+            try:
+                line = format_change(change)[:max_length - len(header) - 1]
+            except Exception:
+                print_exc()
+                change_ids.append(change['change_id'])
+                continue
+            if len(content) + len(line) + 1 > max_length:
+                posts.append((content, change_ids))
+                content, change_ids = header, []
+            content += '\n' + line
+            change_ids.append(change['change_id'])
+        posts.append((content if content != header else None, change_ids))
+    return posts
+
+
+# posts anything new in run_changes. at most NOTIFY_MAX_MESSAGES posts go out per check, a second apart,
+# and anything left over waits for the next check so a big resync doesn't get the bot rate limited
+async def post_notifications(channel):
+    async with write_lock:
+        changes = run_changes_table.get_unnotified()
+    for content, change_ids in build_notifications(changes)[:NOTIFY_MAX_MESSAGES]:
+        if content:
+            await channel.send(content=content)
+        async with write_lock:
+            await asyncio.to_thread(run_changes_table.set_notified, change_ids)
+        if content:
+            await asyncio.sleep(1)
+
+
+async def notify_loop():
+    await client.wait_until_ready()
+    channel = client.get_channel(NOTIFY_CHANNEL_ID) or await client.fetch_channel(NOTIFY_CHANNEL_ID)
+    while True:
+        try:
+            await post_notifications(channel)
+        except Exception:
+            print_exc()
+        await asyncio.sleep(NOTIFY_INTERVAL)
+
+
+def get_memory_budget() -> int or None:
+    return MEMORY_BUDGET_MB * 1024 * 1024 if MEMORY_BUDGET_MB else None
+
+
+# samples memory use every MEMORY_SAMPLE_INTERVAL seconds and evicts caches if it's over budget. this doesn't wait
+# for the write lock, since a resync is when memory use peaks. the caches are only walked for their sizes when
+# something might have to be evicted, and that's done in a thread. the evicting itself is on the event loop like every other
+# change to the caches
+async def memory_loop():
+    while True:
+        try:
+            current = memory.sample()
+            budget = get_memory_budget()
+            # rss is only a cheap check for whether the caches are worth measuring, see memory.get_over_budget
+            if budget and current['rss'] > budget:
+                sizes = await asyncio.to_thread(memory.get_sizes)
+                over = memory.get_over_budget(budget, sizes, current['in_memory_dbs'])
+                if over is None:
+                    print(f'''the in memory dbs ({memory.format_bytes(current['in_memory_dbs'])}) are over the memory '''
+                          f'''budget on their own, raise MEMORY_BUDGET_MB or turn off MEMORY_REPLICA''')
+                elif over:
+                    evicted = memory.evict(over, sizes)
+                    print(f'''over memory budget by {memory.format_bytes(over)}, evicted {', '.join(evicted)}''')
+        except Exception:
+            print_exc()
+        await asyncio.sleep(MEMORY_SAMPLE_INTERVAL)
+
+
+# autocomplete_val is the value from ac.get_categories, this gets the verified runs in that category
+def get_category_where_conds(autocomplete_val: str) -> list:
     name, category, variables = loads(autocomplete_val)
     name = WhereCond('game_name', '=', name)
     category = WhereCond('category_name', '=', category)
     status = WhereCond('status', '=', 'verified')
     variables = [WhereCond('variable_info', 'LIKE', f"%{variable}%") for variable in variables.copy()]
-    row = master_table.select_row_col(cols=['run_id'], where_conds=[name, category, *variables, status], append='ORDER BY igt LIMIT 1')
-    run_id = next(iter(row), {}).get('run_id')
-    return master_table.get_embed_attributes_from_run_id(run_id, ac.format_time)
+    return [name, category, *variables, status]
 
 
-def get_num_verified(*args):
-    pass
+def get_wr(autocomplete_val: str):
+    if autocomplete_val not in wr_cache:
+        row = replica_master_table.select_row_col(cols=['run_id'], where_conds=get_category_where_conds(autocomplete_val), order_by=['igt'], limit=1)
+        run_id = next(iter(row), {}).get('run_id')
+        wr_cache[autocomplete_val] = replica_master_table.get_embed_attributes_from_run_id(run_id, ac.format_time)
+    return wr_cache[autocomplete_val]
 
 
-def get_run(run_id: str):
-    run_id_where = WhereCond('run_id', '=', run_id)
-    return next(iter(master_table.select_row_col(where_conds=[run_id_where])))
+# sets up a paginated view of a category from fastest to slowest, only the page being looked at gets queried
+def get_runs_pages(autocomplete_val: str, date_str: str = None) -> pagination.KeysetPages:
+    name, category, variables = loads(autocomplete_val)
+    date_conds = create_where_conditions_from_date_str(date_str) if date_str else ()
+    where_conds = [*get_category_where_conds(autocomplete_val), *date_conds]
+    selected_cols = ['run_id', 'igt', 'player_name', 'run_date', 'run_video']
+
+    def fetch_page(after: tuple = None, before: tuple = None, limit: int = 10):
+        return replica_master_table.select_page(selected_cols, where_conds=where_conds, after=after, before=before, limit=limit)
 
+    def format_page(rows: list, start: int) -> discord.Embed:
+        lines = []
+        for place, row in enumerate(rows, start):
+            time = ac.format_time(row.get('igt'))
+            time = f'''[{time}]({row.get('run_video')})''' if row.get('run_video') else time
+            run_date = f''' ({row.get('run_date').isoformat()})''' if row.get('run_date') else ''
+            lines.append(f'''{place}. {time} by {row.get('player_name')}{run_date}''')
+        title = f'''{name} - {category} ({', '.join(variables)})''' if variables else f'{name} - {category}'
+        return discord.Embed(title=title, description='\n'.join(lines))
 
-@client.event
-async def on_ready():
-    pass
+    return pagination.KeysetPages(fetch_page, format_page, lambda row: (row.get('igt'), row.get('run_id')))
+
+
+# stats for the verified runs of a category, all worked out from run_store instead of runs_master
+def get_category_stats(autocomplete_val: str, date_str: str = None) -> dict:
+    name, category, variables = loads(autocomplete_val)
+    if not run_store.loaded:
+        # it was cleared to save memory
+        run_store.rebuild(replica_master_table)
+    mask = run_store.filter(game=name, category=category, subcategory=variables, status='verified', date_str=date_str)
+    title = f'''{name} - {category} ({', '.join(variables)})''' if variables else f'{name} - {category}'
+    if not mask.any():
+        return {'title': title, 'description': 'no runs found'}
+    average = run_store.average(mask)
+    median = run_store.percentile(mask, 50)
+    top_10_percent = run_store.percentile(mask, 10)
+    runs_per_month = run_store.runs_per_month(mask)
+    busiest_month = max(runs_per_month, key=runs_per_month.get) if runs_per_month else None
+    top_runners = ', '.join(f'{player} ({num})' for player, num in run_store.top_runners(mask))
+    lines = (
+        f'**Number of Runs**: {int(mask.sum())}',
+        f'**Average Time**: {ac.format_time(average)}' if average is not None else None,
+        f'**Median Time**: {ac.format_time(median)}' if median is not None else None,
+        f'**Top 10% Cutoff**: {ac.format_time(top_10_percent)}' if top_10_percent is not None else None,
+        f'**Busiest Month**: {busiest_month} ({runs_per_month[busiest_month]} runs)' if busiest_month else None,
+        f'**Most Runs**: {top_runners}' if top_runners else None
+    )
+    return {'title': title, 'description': '\n'.join(line for line in lines if line)}
+
+
+# profile of a runner: their totals and their pb in every category they have a verified run in
+def get_runner_profile(user_id: str) -> dict:
+    user_row = next(iter(replica_user_table.select_row_col(where_conds=[WhereCond('user_id', '=', user_id)])), None)
+    if not user_row:
+        raise ValueError('error: runner not found')
+    totals = replica_run_players_table.get_runner_totals(user_id)
+    pbs = replica_run_players_table.get_personal_bests(user_id, replica_master_table)
+    name = user_row.get('user_name')
+    title = f'''{name} (*{user_row.get('pronouns')}*)''' if user_row.get('pronouns') else name
+    lines = [
+        f'''**Runs**: {totals.get('num_runs', 0)} ({totals.get('num_verified') or 0} verified)''',
+        f'''**Total Verified Time**: {ac.format_time(totals.get('total_time') or 0)}'''
+    ]
+    if pbs:
+        lines.append('**Personal Bests**:')
+    for pb in pbs:
+        labels = [str(label) for label in (pb.get('variable_info') or {}).values() if label is not None]
+        subcategory = f''' ({', '.join(labels)})''' if labels else ''
+        lines.append(f'''{pb.get('game_name')} - {pb.get('category_name')}{subcategory}: {ac.format_time(pb.get('igt'))}''')
+    description = '\n'.join(lines)
+    # embed descriptions can't be over 4096 characters
+    if len(description) > 4096:
+        description = description[:description.rfind('\n', 0, 4090)] + '\n...'
+    return {'title': title, 'description': description, 'profile_picture': user_row.get('user_pfp')}
+
+
+# exports runs to a file in EXPORT_DIR and returns its path. the export has its own connection to the db,
+# so it's run in a thread to keep the bot responsive while it writes
+async def export_runs(file_format: str, compress: bool, autocomplete_val: str = None, date_str: str = None,
+                      job: jobs.Job = None) -> str:
+    where_conds = get_category_where_conds(autocomplete_val) if autocomplete_val else []
+    where_conds.extend(create_where_conditions_from_date_str(date_str) if date_str else ())
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f'runs_{datetime.datetime.now():%Y-%m-%d_%H-%M-%S}.{file_format}')
+    progress = job.add if job else None
+    # the export reads runs.db on its own connection, so it holds the write lock the whole time. otherwise a resync
+    # could drop or half fill runs_master partway through. the total is counted from the disk table for the same reason
+    async with write_lock:
+        if job:
+            job.total = await asyncio.to_thread(master_table.count_rows, where_conds)
+        return await asyncio.to_thread(export.export_runs, DB_PATH, path, file_format, compress, where_conds, progress)
+
+
+def get_num_verified(date_str: str = None):
+    status = WhereCond('status', '=', 'verified')
+    date_conds = create_where_conditions_from_date_str(date_str) if date_str else ()
+    return replica_master_table.count_rows(where_conds=[status, *date_conds])
+
+
+def get_run(run_id: str):
+    run_id_where = WhereCond('run_id', '=', run_id)
+    return next(iter(replica_master_table.select_row_col(where_conds=[run_id_where])))
 
 
 @tree.command(name='get_game', description='find a game\'s id')
@@ -142,17 +570,17 @@ async def cmd_get_game(interaction: discord.Interaction, name: str):
 @app_commands.autocomplete(date=ac.get_date)
 async def cmd_get_num_verified(interaction: discord.Interaction, date: str = None):
     try:
-        await interaction.response.send_message(content=f'num verified is none because i havent implemented this')
+        await interaction.response.send_message(content=f'num verified is {get_num_verified(date)}')
     except Exception as error:
         print_exc()
         await interaction.response.send_message(content=error)
 
 
 @tree.command(name='get_run', description='gets a specific run')
-@app_commands.autocomplete(run=ac.get_run(master_table))
+@app_commands.autocomplete(run=ac.get_run(lambda: replica_master_table))
 async def cmd_get_run(interaction: discord.Interaction, run: str):
     try:
-        embed_attributes = (master_table.get_embed_attributes_from_run_id(run, ac.format_time))
+        embed_attributes = (replica_master_table.get_embed_attributes_from_run_id(run, ac.format_time))
         embed = discord.Embed(title=embed_attributes.get('title'),
                               description=embed_attributes.get('description'),
                               url=embed_attributes.get('video_url'))
@@ -165,7 +593,7 @@ async def cmd_get_run(interaction: discord.Interaction, run: str):
 
 
 @tree.command(name='get_wr', description='gets a world record for a specified category')
-@app_commands.autocomplete(run_category=ac.get_categories(variables_table))
+@app_commands.autocomplete(run_category=ac.get_categories(lambda: replica_variables_table))
 async def cmd_get_wr(interaction: discord.Interaction, run_category: str):
     try:
         embed_attributes = get_wr(run_category)
@@ -180,6 +608,122 @@ async def cmd_get_wr(interaction: discord.Interaction, run_category: str):
         await interaction.response.send_message(content=error)
 
 
+@tree.command(name='get_runs', description='browse the verified runs in a category from fastest to slowest')
+@app_commands.autocomplete(run_category=ac.get_categories(lambda: replica_variables_table), date=ac.get_date)
+async def cmd_get_runs(interaction: discord.Interaction, run_category: str, date: str = None):
+    try:
+        pages = get_runs_pages(run_category, date)
+        embed = pages.start()
+        if not embed:
+            await interaction.response.send_message(content='no runs found')
+            return
+        await interaction.response.send_message(embed=embed, view=pages)
+    except Exception as error:
+        print_exc()
+        await interaction.response.send_message(content=error)
+
+
+@tree.command(name='category_stats', description='gets stats about the verified runs in a category')
+@app_commands.autocomplete(run_category=ac.get_categories(lambda: replica_variables_table), date=ac.get_date)
+async def cmd_category_stats(interaction: discord.Interaction, run_category: str, date: str = None):
+    try:
+        stats = get_category_stats(run_category, date)
+        embed = discord.Embed(title=stats.get('title'), description=stats.get('description'))
+        await interaction.response.send_message(embed=embed)
+    except Exception as error:
+        print_exc()
+        await interaction.response.send_message(content=error)
+
+
+@tree.command(name='runner', description='gets a runner\'s stats and personal bests')
+@app_commands.autocomplete(runner=ac.get_runner(lambda: replica_user_table))
+async def cmd_runner(interaction: discord.Interaction, runner: str):
+    try:
+        profile = get_runner_profile(runner)
+        embed = discord.Embed(title=profile.get('title'), description=profile.get('description'))
+        embed.set_thumbnail(url=profile.get('profile_picture'))
+        await interaction.response.send_message(embed=embed)
+    except Exception as error:
+        print_exc()
+        await interaction.response.send_message(content=error)
+
+
+@tree.command(name='export', description='exports the cached runs to a file')
+@app_commands.autocomplete(run_category=ac.get_categories(lambda: replica_variables_table), date=ac.get_date)
+async def cmd_export(interaction: discord.Interaction, file_format: Literal['csv', 'jsonl', 'parquet'] = 'csv',
+                     compress: bool = False, run_category: str = None, date: str = None):
+    upload_limit = interaction.guild.filesize_limit if interaction.guild else export.DEFAULT_UPLOAD_LIMIT
+
+    async def work(job: jobs.Job):
+        path = await export_runs(file_format, compress, run_category, date, job)
+        if os.path.getsize(path) > upload_limit:
+            return {'content': f'the export is too big to upload, it was saved to {path}'}
+        file = discord.File(path)
+        os.remove(path)
+        return {'file': file}
+
+    try:
+        await job_runner.start(interaction, 'export', work)
+    except Exception as error:
+        print_exc()
+        await interaction.followup.send(content=error)
+
+
+@tree.command(name='resync', description='MOD ONLY: resyncs every run of every game from speedrun.com')
+@app_commands.default_permissions(manage_guild=True)
+async def cmd_resync(interaction: discord.Interaction, parallel: bool = False):
+    async def work(job: jobs.Job):
+        # the last resync is the best guess at how many runs there will be
+        job.total = replica_master_table.count_rows()
+        await run_resync_all(parallel, job)
+        return {'content': f'resync finished, {len(run_store)} runs cached'}
+
+    try:
+        await job_runner.start(interaction, 'resync', work)
+    except Exception as error:
+        print_exc()
+        await interaction.followup.send(content=error)
+
+
+@tree.command(name='jobs', description='lists the long running commands that are running or waiting to run')
+async def cmd_jobs(interaction: discord.Interaction):
+    try:
+        running_jobs = job_runner.list_jobs()
+        content = '\n'.join(str(job) for job in running_jobs) if running_jobs else 'no jobs running'
+        await interaction.response.send_message(content=content)
+    except Exception as error:
+        print_exc()
+        await interaction.response.send_message(content=error)
+
+
+@tree.command(name='cancel_job', description='MOD ONLY: cancels a running job')
+@app_commands.default_permissions(manage_guild=True)
+async def cmd_cancel_job(interaction: discord.Interaction, job_id: int):
+    try:
+        if not job_runner.cancel(job_id):
+            await interaction.response.send_message(content=f'there is no job {job_id}')
+            return
+        await interaction.response.send_message(content=f'cancelling job {job_id}')
+    except Exception as error:
+        print_exc()
+        await interaction.response.send_message(content=error)
+
+
+@tree.command(name='memory', description='MOD ONLY: shows what is using memory')
+@app_commands.default_permissions(manage_guild=True)
+async def cmd_memory(interaction: discord.Interaction):
+    try:
+        await interaction.response.defer()
+        sizes = await asyncio.to_thread(memory.get_sizes)
+        current = memory.sample(sizes)
+        top_allocators = await asyncio.to_thread(memory.get_top_allocators)
+        report = memory.format_report(current, get_memory_budget(), top_allocators)
+        await interaction.followup.send(content=report[:2000])
+    except Exception as error:
+        print_exc()
+        await interaction.followup.send(content=error)
+
+
 @tree.command(name='sync', description='MOD ONLY: syncs the application commands')
 async def sync(interaction: discord.Interaction):
     try:
@@ -190,5 +734,9 @@ async def sync(interaction: discord.Interaction):
         await interaction.followup.send(content=error)
 
 if __name__ == '__main__':
+    if MEMORY_TRACE:
+        tracemalloc.start()
+    print(f'imported in {perf_counter() - start_time:.2f}s')
     client.run(config.TOKEN)
-    conn.commit()
+    if conn:
+        conn.commit()
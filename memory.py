@@ -0,0 +1,215 @@
+# keeps track of how much memory the bot is using and what's using it, so it fits on a small server.
+# every cache gets registered here with a way to count it and a way to empty it. when the caches and in memory dbs
+# go over the memory budget, the biggest caches get emptied until enough has been freed (they all rebuild themselves
+# when needed)
+
+import os
+import sqlite3
+import sys
+import tracemalloc
+from collections import deque
+from time import time
+
+# how many samples to keep for /memory
+HISTORY_SIZE = 60
+
+
+class Cache:
+    # entries returns how many things are in the cache, evict empties it.
+    # size_of is what gets measured for the bytes estimate, or None if it can't be (like an lru_cache)
+    def __init__(self, name: str, entries, evict, size_of=None):
+        self.name = name
+        self.entries = entries
+        self.evict = evict
+        self.size_of = size_of
+        self.evictions = 0
+
+    # this can run in a thread while the bot changes the cache, if that happens mid walk there's just no estimate
+    def size(self) -> int or None:
+        try:
+            return estimate_size(self.size_of()) if self.size_of else None
+        except RuntimeError:
+            return None
+
+
+caches = {}
+# connections whose page cache gets reported and shrunk
+connections = {}
+history = deque(maxlen=HISTORY_SIZE)
+
+
+def register(name: str, entries, evict, size_of=None):
+    caches[name] = Cache(name, entries, evict, size_of)
+
+
+# lru_cache functions can't be looked into, so only the number of entries is known
+def register_lru(name: str, function):
+    register(name, lambda: function.cache_info().currsize, function.cache_clear)
+
+
+def register_connection(name: str, conn: sqlite3.Connection):
+    connections[name] = conn
+
+
+# rough deep size of an object in bytes, anything shared is only counted once. getsizeof of a numpy array that owns
+# its data already includes the buffer, a view doesn't, so the array it's a view of gets counted instead.
+# arrays of python objects also count the objects
+def estimate_size(obj) -> int:
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if hasattr(obj, 'nbytes') and hasattr(obj, 'dtype'):
+            if obj.base is not None:
+                stack.append(obj.base)
+            if obj.dtype == object:
+                stack.extend(obj.tolist())
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return total
+
+
+# current resident memory of the process in bytes. /proc is only there on linux, elsewhere this falls back to
+# the peak, which is the best that's available without extra packages
+def get_rss() -> int:
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macos reports bytes, linux reports kilobytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# the page cache limit of each connection and how big its db is. for an in memory db (the replica) the whole db is
+# in memory, for one on disk the cache holds at most the smaller of the two.
+# a connection can only be used on the thread that made it, so this has to be called from the event loop (it's quick)
+def get_sqlite_usage() -> dict:
+    usage = {}
+    for name, conn in connections.items():
+        # the connections return rows as dicts (tables.dict_factory), plain tuples are simpler here
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        try:
+            page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+            page_count = cursor.execute('PRAGMA page_count').fetchone()[0]
+            cache_size = cursor.execute('PRAGMA cache_size').fetchone()[0]
+            # an in memory db has no file
+            in_memory = not cursor.execute('PRAGMA database_list').fetchone()[2]
+        finally:
+            cursor.close()
+        # a negative cache_size is a limit in kibibytes, a positive one is a number of pages
+        cache_limit = -cache_size * 1024 if cache_size < 0 else cache_size * page_size
+        usage[name] = {'db_bytes': page_size * page_count, 'cache_limit': cache_limit, 'in_memory': in_memory}
+    return usage
+
+
+# the n lines of code holding the most memory, or None if tracemalloc was never started
+def get_top_allocators(n: int = 10) -> list:
+    if not tracemalloc.is_tracing():
+        return None
+    stats = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    )).statistics('lineno')
+    return [(str(stat.traceback[0]), stat.size, stat.count) for stat in stats[:n]]
+
+
+def get_sizes() -> dict:
+    return {name: cache.size() for name, cache in caches.items()}
+
+
+# the cheap sample only counts entries. sizes (from get_sizes) adds the bytes of every cache, walking them is slow
+# enough that it should be run in a thread first. this has to be called from the event loop, like get_sqlite_usage
+def sample(sizes: dict = None) -> dict:
+    sizes = sizes if sizes else {}
+    caches_usage = {name: {'entries': cache.entries(), 'bytes': sizes.get(name), 'evictions': cache.evictions}
+                    for name, cache in caches.items()}
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    sqlite_usage = get_sqlite_usage()
+    result = {'time': time(), 'rss': get_rss(), 'traced': traced, 'caches': caches_usage, 'sqlite': sqlite_usage,
+              'in_memory_dbs': sum(usage['db_bytes'] for usage in sqlite_usage.values() if usage['in_memory'])}
+    history.append(result)
+    return result
+
+
+# how many bytes have to be evicted to get under budget. what counts is what the bot keeps around: the caches (sizes
+# from get_sizes) and the in memory dbs, which can't be evicted. rss isn't used for this because memory that was
+# freed often isn't given back to the os, so rss would stay over and every cache would get emptied every sample.
+# returns None if the in memory dbs alone are over, since emptying every cache wouldn't be enough and they'd just
+# get rebuilt
+def get_over_budget(budget: int, sizes: dict, in_memory_dbs: int) -> int or None:
+    cache_bytes = sum(size for size in sizes.values() if size)
+    over = cache_bytes + in_memory_dbs - budget
+    if over > cache_bytes:
+        return None
+    return max(over, 0)
+
+
+# empties the biggest caches until about over bytes should have been freed. sizes come from get_sizes, caches with
+# no size estimate go last. sqlite connections are asked to give back their page cache as well.
+# returns the names of what was evicted
+def evict(over: int, sizes: dict) -> list:
+    evicted = []
+    for name, size in sorted(sizes.items(), key=lambda item: item[1] or 0, reverse=True):
+        if not caches[name].entries():
+            continue
+        caches[name].evict()
+        caches[name].evictions += 1
+        evicted.append(name)
+        over -= size or 0
+        if over <= 0:
+            break
+    for conn in connections.values():
+        conn.execute('PRAGMA shrink_memory')
+    return evicted
+
+
+def format_bytes(num_bytes) -> str:
+    if num_bytes is None:
+        return '?'
+    for unit in ('B', 'KB', 'MB'):
+        if abs(num_bytes) < 1024:
+            return f'{num_bytes:.0f}{unit}' if unit == 'B' else f'{num_bytes:.1f}{unit}'
+        num_bytes /= 1024
+    return f'{num_bytes:.1f}GB'
+
+
+# the text for /memory
+def format_report(current: dict, budget: int = None, top_allocators: list = None) -> str:
+    lines = [f'''**Memory**: {format_bytes(current['rss'])}''']
+    cache_bytes = sum(usage['bytes'] or 0 for usage in current['caches'].values())
+    budget_str = f' of {format_bytes(budget)}' if budget else ''
+    lines.append(f'''**Counted toward budget**: {format_bytes(cache_bytes + current['in_memory_dbs'])}{budget_str} '''
+                 f'''({format_bytes(cache_bytes)} caches, {format_bytes(current['in_memory_dbs'])} in memory dbs)''')
+    if current['traced'] is not None:
+        lines.append(f'''**Traced by tracemalloc**: {format_bytes(current['traced'])}''')
+    if history:
+        peak = max(previous['rss'] for previous in history)
+        lines.append(f'**Peak of the last {len(history)} samples**: {format_bytes(peak)}')
+    lines.append('**Caches**:')
+    for name, usage in current['caches'].items():
+        lines.append(f'''{name}: {usage['entries']} entries, {format_bytes(usage['bytes'])}, '''
+                     f'''evicted {usage['evictions']} times''')
+    lines.append('**SQLite**:')
+    for name, usage in current['sqlite'].items():
+        in_memory = ' (in memory)' if usage['in_memory'] else ''
+        lines.append(f'''{name}: db is {format_bytes(usage['db_bytes'])}{in_memory}, page cache limit '''
+                     f'''{format_bytes(usage['cache_limit'])}''')
+    if top_allocators:
+        lines.append('**Top Allocators**:')
+        lines.extend(f'`{line}`: {format_bytes(size)} in {count} blocks' for line, size, count in top_allocators)
+    elif top_allocators is None:
+        lines.append('tracemalloc is off, set MEMORY_TRACE in the config to see the top allocators')
+    return '\n'.join(lines)
@@ -0,0 +1,49 @@
+import discord
+
+
+# a message with prev/next buttons that only ever queries the page it's showing.
+# fetch_page(after=, before=, limit=) should return rows using keyset pagination (like MasterTable.select_page),
+# key_func(row) gives the key of a row, and format_page(rows, start) turns a page into an embed
+class KeysetPages(discord.ui.View):
+
+    def __init__(self, fetch_page, format_page, key_func, page_size: int = 10, timeout: float = 300):
+        super().__init__(timeout=timeout)
+        self.fetch_page = fetch_page
+        self.format_page = format_page
+        self.key_func = key_func
+        self.page_size = page_size
+        self.page_num = 0
+        self.rows = []
+        self.has_next = False
+
+    # we ask for one more row than we show, that way we know if there's a next page without counting everything
+    def load_next(self, after: tuple = None):
+        rows = self.fetch_page(after=after, limit=self.page_size + 1)
+        self.has_next = len(rows) > self.page_size
+        self.rows = rows[:self.page_size]
+
+    def load_prev(self, before: tuple):
+        self.rows = self.fetch_page(before=before, limit=self.page_size)
+        self.has_next = True
+
+    def embed(self) -> discord.Embed:
+        self.prev_page.disabled = self.page_num == 0
+        self.next_page.disabled = not self.has_next
+        return self.format_page(self.rows, self.page_num * self.page_size + 1)
+
+    # loads the first page and returns its embed, or None if there's nothing to show
+    def start(self) -> discord.Embed or None:
+        self.load_next()
+        return self.embed() if self.rows else None
+
+    @discord.ui.button(label='Prev', style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.load_prev(self.key_func(self.rows[0]))
+        self.page_num -= 1
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.load_next(self.key_func(self.rows[-1]))
+        self.page_num += 1
+        await interaction.response.edit_message(embed=self.embed(), view=self)
@@ -0,0 +1,105 @@
+# on a full resync, decoding the api pages and parsing the runs into rows is pure cpu work.
+# this spreads that over a pool of processes, while the main process fetches pages and is the only one writing to sqlite
+
+from json import loads
+from multiprocessing import Pool
+import config
+import speedruncom_integration as src
+import tables
+
+# both of these are optional in the config. None workers means one per core
+WORKERS = getattr(config, 'PARSE_WORKERS', None)
+BATCH_SIZE = getattr(config, 'PARSE_BATCH_SIZE', 1000)
+
+# set in each worker by init_worker, since the lookups are the same for every page
+worker_lookups = {}
+
+
+def init_worker(lookups: dict):
+    global worker_lookups
+    worker_lookups = lookups
+
+
+# one pass over each page: its users, its runs parsed without verifiers (see MasterTable.resolve_verifiers),
+# and the verifier of each run so they can be filled in once every user is known
+def parse_page(page: bytes) -> tuple:
+    runs = loads(page).get('data')
+    master_rows = [src.parse_call_into_master_row(run, worker_lookups) for run in runs]
+    verifier_ids = [run.get('status').get('examiner') for run in runs]
+    return src.parse_runs_into_users_rows(runs), master_rows, verifier_ids
+
+
+# writes the parsed pages as they come in, batch_size runs at a time, so only the ids seen so far are kept in memory.
+# the api can return the same run (and user) on two pages, so both are deduplicated on their ids.
+# the verifier of each run is saved as it's written and they're all filled in from the users table at the end.
+# this has to run inside a tables.transaction, so a failed request or a cancel doesn't leave the tables half written
+def write_parsed_pages(parsed_pages,
+                       user_table: tables.UserTable,
+                       master_table: tables.MasterTable,
+                       run_players_table: tables.RunPlayersTable,
+                       batch_size: int = BATCH_SIZE,
+                       progress=None) -> int:
+    for table in (user_table, master_table, run_players_table):
+        table.drop_table()
+        table.create_table()
+    master_table.create_verifiers_table()
+    seen_users = set()
+    seen_runs = set()
+    user_rows, master_rows, verifier_rows = [], [], []
+
+    def write_batch():
+        user_table.insert_multiple_runs(user_rows)
+        master_table.insert_multiple_runs(master_rows)
+        run_players_table.insert_multiple_runs(src.parse_master_rows_into_run_players_rows(master_rows))
+        master_table.add_verifiers(verifier_rows)
+        for rows in (user_rows, master_rows, verifier_rows):
+            rows.clear()
+
+    for page_user_rows, page_master_rows, page_verifier_ids in parsed_pages:
+        for row in page_user_rows:
+            if row[0] not in seen_users:
+                seen_users.add(row[0])
+                user_rows.append(row)
+        num_runs = len(seen_runs)
+        for row, verifier in zip(page_master_rows, page_verifier_ids):
+            if row[0] not in seen_runs:
+                seen_runs.add(row[0])
+                master_rows.append(row)
+                verifier_rows.append((row[0], verifier))
+        if progress:
+            progress(pages=1, rows=len(seen_runs) - num_runs)
+        if len(master_rows) >= batch_size:
+            write_batch()
+    write_batch()
+    master_table.resolve_verifiers(user_table)
+    return len(seen_runs)
+
+
+# resyncs the users, runs_master and run_players from every run of every game. pages get parsed by the workers while
+# the next ones are being fetched, and the main process is the only one writing. parallel=False parses them in this
+# process instead, for small games where starting the pool isn't worth it.
+# progress (like jobs.Job.add) gets called with pages=1 and rows= for every page parsed
+def resync_master_user(game_ids,
+                       category_table: tables.CategoryTable,
+                       variable_table: tables.VariableTable,
+                       user_table: tables.UserTable,
+                       master_table: tables.MasterTable,
+                       run_players_table: tables.RunPlayersTable,
+                       workers: int = WORKERS,
+                       batch_size: int = BATCH_SIZE,
+                       progress=None,
+                       parallel: bool = True):
+    # pool.imap pulls from this in a background thread
+    def fetch_pages():
+        for game_id in game_ids:
+            yield from src.get_all_runs_users_pages(game_id)
+
+    # the verifiers are filled in after, so the runs don't need any users to be parsed
+    lookups = src.get_master_lookups(category_table, variable_table, user_table, runs=[])
+    if not parallel:
+        init_worker(lookups)
+        return write_parsed_pages(map(parse_page, fetch_pages()), user_table, master_table, run_players_table,
+                                  batch_size, progress)
+    with Pool(workers, initializer=init_worker, initargs=(lookups,)) as pool:
+        return write_parsed_pages(pool.imap(parse_page, fetch_pages()), user_table, master_table, run_players_table,
+                                  batch_size, progress)
@@ -0,0 +1,203 @@
+# a column by column copy of runs_master held in numpy arrays, for stats that would otherwise have to pull every row
+# out of sqlite. times and dates are plain float arrays, and text columns are stored as integer codes that index into a
+# list of their distinct values, so filtering is comparing ints and aggregating is a couple of numpy calls
+
+from json import loads
+import numpy as np
+import tables
+import where
+
+# julianday() of 0001-01-01 is 1721425.5 and date(1, 1, 1).toordinal() is 1
+JULIAN_DAY_OFFSET = 1721424.5
+# date(1970, 1, 1).toordinal(), to turn ordinals into numpy datetimes
+EPOCH_ORDINAL = 719163
+FETCH_SIZE = 5000
+
+
+class RunStore:
+    # text columns that get dictionary encoded. variable_info is encoded as its raw json
+    CODED_COLS = ('game_name', 'category_name', 'status', 'variable_info')
+
+    def __init__(self):
+        self.run_ids = np.array([], dtype=object)
+        self.igt = np.array([], dtype=np.float64)
+        self.rta = np.array([], dtype=np.float64)
+        # date ordinals, nan if the run has no date
+        self.run_date = np.array([], dtype=np.float64)
+        self.codes = {col: np.array([], dtype=np.int32) for col in self.CODED_COLS}
+        # code -> value and value -> code for each coded column
+        self.values = {col: [] for col in self.CODED_COLS}
+        self.value_codes = {col: {} for col in self.CODED_COLS}
+        # a run can have more than one player, so players get a row each: player_runs is the index of the run and
+        # player_codes is the code of the player (their user id, in values['player']). player_names is by code too
+        self.player_runs = np.array([], dtype=np.int64)
+        self.player_codes = np.array([], dtype=np.int32)
+        self.values['player'] = []
+        self.value_codes['player'] = {}
+        self.player_names = []
+        # False until rebuild is called, and again after clear. an empty store that isn't loaded can't be patched
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.run_ids)
+
+    # run_date, variable_info and player_info are read as a number and as text, so none of the converters run while loading
+    @staticmethod
+    def query(where_conds: list = None) -> tuple:
+        cols = ['run_id', 'igt', 'rta', 'julianday(run_date)', *[f'CAST({col} AS TEXT)' for col in RunStore.CODED_COLS],
+                'CAST(player_info AS TEXT)']
+        return where.build_select('runs_master', cols, where_conds)
+
+    def load(self, master_table: tables.MasterTable, where_conds: list = None) -> dict:
+        cursor = master_table.conn.cursor()
+        cursor.row_factory = None
+        columns = {col: [] for col in ('run_id', 'igt', 'rta', 'run_date', *self.CODED_COLS, 'player_info')}
+        try:
+            cursor.execute(*self.query(where_conds))
+            while rows := cursor.fetchmany(FETCH_SIZE):
+                for col, values in zip(columns.values(), zip(*rows)):
+                    col.extend(values)
+        finally:
+            cursor.close()
+        return columns
+
+    def encode(self, col: str, values: list) -> np.ndarray:
+        value_codes = self.value_codes[col]
+        for value in values:
+            if value not in value_codes:
+                value_codes[value] = len(self.values[col])
+                self.values[col].append(value)
+        return np.fromiter((value_codes[value] for value in values), dtype=np.int32, count=len(values))
+
+    # player_info is the json of users.Users, {user_id: {'user_name': ...}}. returns player_runs and player_codes
+    # for the new runs, and keeps player_names up to date with the latest name of each player
+    def encode_players(self, player_infos: list) -> tuple:
+        player_codes = self.value_codes['player']
+        runs = []
+        codes = []
+        for index, player_info in enumerate(player_infos):
+            for player_id, player in (loads(player_info) if player_info else {}).items():
+                if player_id not in player_codes:
+                    player_codes[player_id] = len(self.values['player'])
+                    self.values['player'].append(player_id)
+                    self.player_names.append(None)
+                self.player_names[player_codes[player_id]] = player.get('user_name')
+                runs.append(len(self) + index)
+                codes.append(player_codes[player_id])
+        return np.array(runs, dtype=np.int64), np.array(codes, dtype=np.int32)
+
+    def append(self, columns: dict):
+        player_runs, player_codes = self.encode_players(columns['player_info'])
+        self.player_runs = np.concatenate([self.player_runs, player_runs])
+        self.player_codes = np.concatenate([self.player_codes, player_codes])
+        self.run_ids = np.concatenate([self.run_ids, np.array(columns['run_id'], dtype=object)])
+        self.igt = np.concatenate([self.igt, np.array(columns['igt'], dtype=np.float64)])
+        self.rta = np.concatenate([self.rta, np.array(columns['rta'], dtype=np.float64)])
+        run_date = np.array(columns['run_date'], dtype=np.float64) - JULIAN_DAY_OFFSET
+        self.run_date = np.concatenate([self.run_date, run_date])
+        for col in self.CODED_COLS:
+            self.codes[col] = np.concatenate([self.codes[col], self.encode(col, columns[col])])
+
+    def keep(self, mask: np.ndarray):
+        # the runs that are kept move down to fill the gaps, so the players point at their new index
+        new_index = np.cumsum(mask) - 1
+        kept_players = mask[self.player_runs]
+        self.player_runs = new_index[self.player_runs[kept_players]]
+        self.player_codes = self.player_codes[kept_players]
+        self.run_ids = self.run_ids[mask]
+        self.igt = self.igt[mask]
+        self.rta = self.rta[mask]
+        self.run_date = self.run_date[mask]
+        for col in self.CODED_COLS:
+            self.codes[col] = self.codes[col][mask]
+
+    # throws everything out and reads runs_master again, for after a full resync
+    def rebuild(self, master_table: tables.MasterTable):
+        self.__init__()
+        self.append(self.load(master_table))
+        self.loaded = True
+
+    # frees everything, for when memory runs low. it has to be rebuilt before it's used again
+    def clear(self):
+        self.__init__()
+
+    # only rereads the given runs, for when a sync only touched a few of them. runs that were deleted just get dropped
+    def patch(self, master_table: tables.MasterTable, run_ids):
+        if not self.loaded:
+            return
+        run_ids = list(run_ids)
+        self.keep(~np.isin(self.run_ids, np.array(run_ids, dtype=object)))
+        for batch in where.batch_values(run_ids):
+            self.append(self.load(master_table, [where.WhereCond('run_id', 'IN', batch)]))
+
+    # mask for everything equal to value in a coded column. a value we've never seen matches nothing
+    def equals(self, col: str, value) -> np.ndarray:
+        code = self.value_codes[col].get(value)
+        return self.codes[col] == code if code is not None else np.zeros(len(self), dtype=bool)
+
+    # mask of runs that have every one of the variable values in subcategory (like the LIKE filter in main does).
+    # this only has to be worked out once per distinct variable_info, then it's just indexed by code
+    def has_variables(self, subcategory) -> np.ndarray:
+        matches = np.array([bool(value) and all(var in loads(value).values() for var in subcategory)
+                            for value in self.values['variable_info']], dtype=bool)
+        return matches[self.codes['variable_info']] if len(matches) else np.zeros(len(self), dtype=bool)
+
+    # date_str is anything where.create_where_conditions_from_date_str takes
+    def in_dates(self, date_str: str) -> np.ndarray:
+        start, end = where.parse_date_str(date_str).bounds()
+        mask = ~np.isnan(self.run_date)
+        if start:
+            mask &= self.run_date >= start.toordinal()
+        if end:
+            mask &= self.run_date < end.toordinal()
+        return mask
+
+    def filter(self, game: str = None, category: str = None, subcategory=(), status: str = None,
+               player: str = None, date_str: str = None) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        for col, value in (('game_name', game), ('category_name', category), ('status', status)):
+            if value is not None:
+                mask &= self.equals(col, value)
+        if player is not None:
+            mask &= self.has_player(player)
+        if subcategory:
+            mask &= self.has_variables(subcategory)
+        if date_str:
+            mask &= self.in_dates(date_str)
+        return mask
+
+    def times(self, mask: np.ndarray, col: str = 'igt') -> np.ndarray:
+        times = getattr(self, col)[mask]
+        return times[~np.isnan(times)]
+
+    def average(self, mask: np.ndarray, col: str = 'igt') -> float or None:
+        times = self.times(mask, col)
+        return float(times.mean()) if len(times) else None
+
+    def percentile(self, mask: np.ndarray, q: float, col: str = 'igt') -> float or None:
+        times = self.times(mask, col)
+        return float(np.percentile(times, q)) if len(times) else None
+
+    # {'YYYY-MM': number of runs} in order
+    def runs_per_month(self, mask: np.ndarray) -> dict:
+        ordinals = self.run_date[mask]
+        ordinals = ordinals[~np.isnan(ordinals)].astype(np.int64)
+        months = (ordinals - EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]')
+        months, counts = np.unique(months, return_counts=True)
+        return {str(month): int(count) for month, count in zip(months, counts)}
+
+    # mask of the runs player (a user id) is one of the players of
+    def has_player(self, player: str) -> np.ndarray:
+        mask = np.zeros(len(self), dtype=bool)
+        code = self.value_codes['player'].get(player)
+        if code is not None:
+            mask[self.player_runs[self.player_codes == code]] = True
+        return mask
+
+    # [(player_name, number of runs)] for the n players with the most runs. a run with more than one player counts
+    # for each of them
+    def top_runners(self, mask: np.ndarray, n: int = 5) -> list:
+        codes = self.player_codes[mask[self.player_runs]]
+        counts = np.bincount(codes, minlength=len(self.values['player']))
+        top = np.argsort(counts, kind='stable')[::-1][:n]
+        return [(self.player_names[code], int(counts[code])) for code in top if counts[code]]
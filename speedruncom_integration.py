@@ -2,14 +2,17 @@
 # also any functions that help go through src responses will go here
 
 from datetime import date
+from json import loads
+from time import sleep
 import requests
 import config
 import users
 import tables
-from where import WhereCond
 
 header = config.HEADER
 url = 'https://www.speedrun.com/api/v1/'
+# seconds between leaderboard requests, the api allows about 100 requests a minute. optional in the config
+LEADERBOARD_REQUEST_DELAY = getattr(config, 'LEADERBOARD_REQUEST_DELAY', 1)
 
 
 # returns a game response
@@ -41,7 +44,8 @@ def get_all_categories(game_id: str):
     return categories
 
 
-def get_all_runs_users(game_id: str):
+# on_page gets called with the runs of each page after it's fetched, so they can be parsed as they come in
+def get_all_runs_users(game_id: str, on_page=None):
     runs_url = url + 'runs'
     params = {
         'game': game_id,
@@ -50,19 +54,83 @@ def get_all_runs_users(game_id: str):
         'orderby': 'date',
         'direction': 'desc'
     }
-    runs = iterate_through_responses(runs_url, params)
+    runs = iterate_through_responses(runs_url, params, on_page=on_page)
     unique_runs = duplicate_remover(runs, lambda x: x.get('id'))
     return unique_runs
 
 
+# same as get_all_runs_users, but yields each page undecoded so the decoding can be done somewhere else.
+# runs aren't deduplicated here, whatever decodes the pages has to do that
+def get_all_runs_users_pages(game_id: str):
+    runs_url = url + 'runs'
+    params = {
+        'game': game_id,
+        'max': 200,
+        'embed': 'players',
+        'orderby': 'date',
+        'direction': 'desc'
+    }
+    return iterate_through_raw_pages(runs_url, params)
+
+
+# gets the top runs of one category, variables is {variable_id: value_id} to pick the subcategory.
+# this is one request no matter how many runs the category has, so it's cheap enough to do often
+def get_leaderboard(game_id: str, category_id: str, variables: dict = None, top: int = 10) -> dict:
+    leaderboard_url = url + f'leaderboards/{game_id}/category/{category_id}'
+    params = {
+        'top': top,
+        'embed': 'players'
+    }
+    params.update({f'var-{variable_id}': value_id for variable_id, value_id in (variables or {}).items()})
+    response = requests.get(leaderboard_url, params=params, headers=header)
+    if response.status_code is not requests.codes.ok:
+        raise requests.HTTPError(f'error: code {response.status_code}')
+    return response.json().get('data')
+
+
+# leaderboards embed the players once for the whole board instead of on each run,
+# so this puts them back on each run to make them look like the runs from get_all_runs_users
+def get_runs_from_leaderboard(leaderboard: dict) -> list:
+    def player_key(player):
+        return player.get('id') if player.get('rel') == 'user' else 'guest_' + player.get('name')
+
+    embedded_players = {player_key(player): player for player in leaderboard.get('players', {}).get('data', [])}
+    runs = []
+    for place in leaderboard.get('runs'):
+        run = dict(place.get('run'))
+        run['players'] = {'data': [embedded_players.get(player_key(player), player) for player in run.get('players')]}
+        runs.append(run)
+    return runs
+
+
+# combos come from autocomplete.get_category_combos. the requests are spaced out by delay so a refresh stays under
+# the rate limit. per level categories don't have a leaderboard at this endpoint, so they're skipped, and a board that
+# can't be fetched is skipped so it doesn't stop the rest from refreshing
+def get_leaderboard_runs(combos: list, top: int = 10, delay: float = LEADERBOARD_REQUEST_DELAY) -> list:
+    runs = []
+    combos = [combo for combo in combos if combo.get('category_type') != 'per-level']
+    for num, combo in enumerate(combos):
+        if num:
+            sleep(delay)
+        try:
+            leaderboard = get_leaderboard(combo.get('game_id'), combo.get('category_id'), combo.get('variables'), top)
+        except requests.HTTPError as error:
+            print(f'''skipping leaderboard {combo.get('category_id')} {combo.get('variables')}: {error}''')
+            continue
+        runs.extend(get_runs_from_leaderboard(leaderboard))
+    return duplicate_remover(runs, lambda x: x.get('id'))
+
+
 # since the api has a max request, we need to iterate through them sometimes, so this function does that
-def iterate_through_responses(p_url: str, params: dict, limit: int = -1):
+def iterate_through_responses(p_url: str, params: dict, limit: int = -1, on_page=None):
     all_responses = []
     while True:
         response = requests.get(p_url, params=params, headers=header)
         if response.status_code is not requests.codes.ok:
             raise requests.HTTPError(f'error: code {response.status_code}')
         data = response.json()
+        if on_page:
+            on_page(data.get('data'))
         all_responses.extend(data.get('data'))
         # we check if the size of the request is less than the size we requested for to see if we've hit the end
         # (indicating the end of the sequence we were requesting)
@@ -80,6 +148,32 @@ def iterate_through_responses(p_url: str, params: dict, limit: int = -1):
     return all_responses
 
 
+# like iterate_through_responses, but yields the raw bytes of each page instead of decoding everything
+def iterate_through_raw_pages(p_url: str, params: dict):
+    while True:
+        response = requests.get(p_url, params=params, headers=header)
+        if response.status_code is not requests.codes.ok:
+            raise requests.HTTPError(f'error: code {response.status_code}')
+        content = response.content
+        yield content
+        pagination = get_pagination_from_raw(content)
+        if not pagination or pagination.get('size') < params.get('max'):
+            break
+        next_uri = next((uri.get('uri') for uri in pagination.get('links') if uri.get('rel') == 'next'), None)
+        if not next_uri:
+            break
+        p_url = next_uri
+
+
+# pagination is always the last key in a response, and any "pagination" inside a string would have escaped quotes,
+# so the last match is the real one. this lets us find the next page without decoding the whole page
+def get_pagination_from_raw(content: bytes) -> dict or None:
+    start = content.rfind(b'"pagination"')
+    if start == -1:
+        return None
+    return loads(b'{' + content[start:]).get('pagination')
+
+
 def duplicate_remover(entries, primary_key_func):
     unique = set()
     unique_entries = []
@@ -128,7 +222,8 @@ def parse_variables_into_rows(variables):
         name = variable.get('name')
         values = {key: value.get('label') for key, value in variable.get('values').get('values').items()}
         category_id = variable.get('category')
-        rows.append((variable_id, category_id, name, values))
+        is_subcategory = variable.get('is-subcategory')
+        rows.append((variable_id, category_id, name, values, is_subcategory))
     return rows
 
 
@@ -138,10 +233,15 @@ def parse_categories_into_rows(categories):
         category_id = category.get('id')
         category_name = category.get('name')
         category_game_id = category.get('game_id')
-        category_rows.append((category_id, category_name, category_game_id))
+        category_type = category.get('type')
+        category_rows.append((category_id, category_name, category_game_id, category_type))
     return category_rows
 
 
+# the order of the rows parse_runs_into_users_rows makes, same as the users table
+USER_COLS = ('user_id', 'user_name', 'pronouns', 'user_type', 'user_pfp')
+
+
 def parse_runs_into_users_rows(runs):
     user_rows = list()
     for run in runs:
@@ -162,10 +262,29 @@ def parse_runs_into_users_rows(runs):
     return user_rows
 
 
-def parse_call_into_master_row(run: dict,
-                               category_table: tables.CategoryTable,
-                               variable_table: tables.VariableTable,
-                               user_table: tables.UserTable):
+# everything parse_call_into_master_row needs from the other tables, pulled out once up front.
+# this way parsing a run doesn't touch the db (which also means it can be done in another process)
+# if runs is given, only the users that verified those runs are looked up instead of the whole users table
+# (so an empty list means no users, for when the verifiers get filled in later, see MasterTable.resolve_verifiers)
+def get_master_lookups(category_table: tables.CategoryTable,
+                       variable_table: tables.VariableTable,
+                       user_table: tables.UserTable,
+                       runs: list = None) -> dict:
+    categories = category_table.select_row_col(cols=['category_id', 'name'])
+    variables = variable_table.select_row_col(cols=['variable_id', 'var_name', 'var_values'])
+    if runs is None:
+        user_rows = user_table.select_row_col()
+    else:
+        user_rows = user_table.select_rows_in('user_id', [run.get('status').get('examiner') for run in runs])
+    return {
+        'categories': {row.get('category_id'): row.get('name') for row in categories},
+        'variables': {row.get('variable_id'): row for row in variables},
+        'users': {row.get('user_id'): row for row in user_rows}
+    }
+
+
+# lookups comes from get_master_lookups
+def parse_call_into_master_row(run: dict, lookups: dict):
     run_id = run.get('id')
     game_id = run.get('game')
     game_name = config.GAMES.get(game_id)
@@ -176,21 +295,16 @@ def parse_call_into_master_row(run: dict,
     times = run.get('times')
     rta = times.get('realtime_t')
     igt = times.get('ingame_t') if times.get('ingame_t') != 0 else rta
-    run_video = next(iter(run.get('videos').get('links', [])), {}).get('uri')
+    run_video = next(iter((run.get('videos') or {}).get('links', [])), {}).get('uri')
     comment = run.get('comment')
     category = run.get('category')
-    category_row = next(iter(category_table.select_row_col(cols=['name'], where_conds=[WhereCond('category_id', '=', category)])), None)
-    category_name = category_row.get('name') if category_row else None
+    category_name = lookups.get('categories').get(category)
     variables = run.get('values')
-    variable_rows = [variable_table.select_row_col(
-            cols=['''var_name''', f'''JSON_EXTRACT(var_values, '$.{variables[variable]}') AS 'var_values' '''],
-            where_conds=[WhereCond('variable_id', '=', variable)])[0] for variable in variables]
-    variables_info = {variable.get('var_name'): variable.get('var_values') for variable in variable_rows}
+    variable_rows = lookups.get('variables')
+    variables_info = {variable_rows[variable].get('var_name'): variable_rows[variable].get('var_values').get(value)
+                      for variable, value in variables.items() if variable in variable_rows}
     status_dict = run.get('status')
-    verifier = status_dict.get('examiner')
-    verifier_row = next(iter(user_table.select_row_col(where_conds=[WhereCond('user_id', '=', verifier)])), None)
-    verifier_info = users.get_user_from_user_row(verifier_row) if verifier_row else None
-    verifier_name = verifier_info.get_value('user_name')[0] if verifier_row else None
+    verifier_info, verifier_name = get_verifier(status_dict.get('examiner'), lookups.get('users'))
     verify_date = date.fromisoformat(status_dict.get('verify-date')[:10]) if status_dict.get('verify-date') else None
     status = status_dict.get('status')
     reason = status_dict.get('reason')
@@ -215,3 +329,23 @@ def parse_call_into_master_row(run: dict,
         status,
         reason
     )
+
+
+# verifier_info and verifier_name for a run, user_lookup is {user_id: user row as a dict}
+def get_verifier(verifier: str, user_lookup: dict) -> tuple:
+    verifier_row = user_lookup.get(verifier)
+    if not verifier_row:
+        return None, None
+    verifier_info = users.get_user_from_user_row(dict(verifier_row))
+    return verifier_info, verifier_info.get_value('user_name')[0]
+
+
+# splits rows from parse_call_into_master_row into one row per player for the run_players table
+def parse_master_rows_into_run_players_rows(master_rows):
+    run_players_rows = []
+    for row in master_rows:
+        run_id, game_id, game_name, date_run, users_obj, users_name, rta, igt, run_video, comment, category, \
+            category_name, variables, variables_info, verifier_info, verifier_name, verify_date, status, reason = row
+        for user_id in users_obj.users:
+            run_players_rows.append((run_id, user_id, game_name, category_name, variables_info, igt, status))
+    return run_players_rows
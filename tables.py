@@ -1,20 +1,46 @@
 # this deals with every sql query.
 
 import sqlite3
+from contextlib import contextmanager
 from datetime import date
 import users
+import where
 from where import WhereCond
 
 
+# connections that are inside a transaction (see transaction), which tables don't commit after every query
+open_transactions = set()
+
+
+# everything written to conn inside this is committed together at the end, or rolled back if anything raises
+# (like a cancelled job or a failed request), so a sync never leaves the tables half written
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    conn.commit()
+    conn.execute('BEGIN')
+    open_transactions.add(conn)
+    try:
+        yield
+    except BaseException:
+        open_transactions.discard(conn)
+        conn.rollback()
+        raise
+    open_transactions.discard(conn)
+    conn.commit()
+
+
 # base class for all tables later, contains sql calling logic
 class BaseTable:
 
-    def __init__(self, conn: sqlite3.Connection, name: str, cols: tuple, col_types: tuple, primary_key: str = None):
+    def __init__(self, conn: sqlite3.Connection, name: str, cols: tuple, col_types: tuple, primary_key: str = None,
+                 indexes: tuple = tuple()):
         self.conn = conn
         self.COLS = cols
         self.COL_TYPES = col_types
         self.NAME = name
         self.PRIMARY_KEY = primary_key
+        # each index is a tuple of the columns it covers, in order
+        self.INDEXES = indexes
         self.create_table()
 
     def __call__(self, query, input_row: tuple = tuple(), error_handle_graceful: bool = False):
@@ -28,7 +54,7 @@ class BaseTable:
                 raise ValueError('error: could not properly select from table\nquery: ' + query + '\nparams:' + str(input_row) + '\nerror: ' + str(error))
         data = cursor.fetchall()
         cursor.close()
-        self.conn.commit()
+        self.commit()
         return data
 
     def executemany(self, query, input_rows: list):
@@ -39,13 +65,35 @@ class BaseTable:
             raise ValueError('error: could not properly select from table\nquery:', query, '\nerror:', str(error))
         data = cursor.fetchall()
         cursor.close()
-        self.conn.commit()
+        self.commit()
         return data
 
+    def commit(self):
+        if self.conn not in open_transactions:
+            self.conn.commit()
+
     def create_table(self):
         cols = tuple(f'{col} {col_type}' for col, col_type in zip(self.COLS, self.COL_TYPES))
         query = f'''CREATE TABLE IF NOT EXISTS {self.NAME} ({', '.join(cols)})'''
-        return self(query)
+        data = self(query)
+        self.add_missing_cols()
+        self.create_indexes()
+        return data
+
+    # a table made before a column was added to COLS won't have it, so it gets added (empty until the next resync)
+    def add_missing_cols(self):
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        existing = {row[1] for row in cursor.execute(f'''PRAGMA table_info({self.NAME})''').fetchall()}
+        cursor.close()
+        for col, col_type in zip(self.COLS, self.COL_TYPES):
+            if col not in existing:
+                self(f'''ALTER TABLE {self.NAME} ADD COLUMN {col} {col_type}''')
+
+    def create_indexes(self):
+        for index_cols in self.INDEXES:
+            index_name = f'idx_{self.NAME}_' + '_'.join(index_cols)
+            self(f'''CREATE INDEX IF NOT EXISTS {index_name} ON {self.NAME} ({', '.join(index_cols)})''')
 
     def insert_single_row(self, row: tuple):
         if len(row) != len(self.COLS):
@@ -61,23 +109,31 @@ class BaseTable:
         VALUES ({', '.join(['?' for _ in self.COLS])}) RETURNING *'''
         return self.executemany(query, rows)
 
+    # inserts rows, replacing any rows that already have the same primary key.
+    # key replaces every row with the same value in that column instead, for tables without a primary key
+    def upsert_rows(self, rows: list, key: str = None):
+        key = key if key else self.PRIMARY_KEY
+        key_index = self.COLS.index(key)
+        for batch in where.batch_values([row[key_index] for row in rows]):
+            query = f'''DELETE FROM {self.NAME} WHERE {where.format_cond(key, 'IN', None, len(batch))}'''
+            self(query, tuple(batch))
+        return self.insert_multiple_runs(rows)
+
     # cols is a tuple listing columns you want from the table
     # where_conds is a set of WhereConds objects that specify the conditions
-    def select_row_col(self, cols: list = None, where_conds: list = None, append: str = None):
-
-        if not cols:
-            cols = ['*']
-
-        conditions = [where_cond() for where_cond in where_conds] if where_conds else []
-        query = f'''SELECT {', '.join(cols)} FROM {self.NAME}'''
-        if conditions:
-            query += f''' WHERE {' AND '.join(conditions)}'''
-        if append:
-            query += append
-
-        params = tuple(arg.value for arg in where_conds) if where_conds else ()
+    # order_by is a list of columns (with ASC/DESC if needed), limit caps the number of rows returned
+    def select_row_col(self, cols: list = None, where_conds: list = None, order_by: list = None, limit: int = None):
+        query, params = where.build_select(self.NAME, cols, where_conds, order_by, limit)
         return self(query, params)
 
+    # gets every row where col is one of values in as few queries as possible, instead of one query per value
+    def select_rows_in(self, col: str, values, cols: list = None, where_conds: list = None):
+        where_conds = where_conds if where_conds else []
+        rows = []
+        for batch in where.batch_values(values):
+            rows.extend(self.select_row_col(cols=cols, where_conds=[WhereCond(col, 'IN', batch), *where_conds]))
+        return rows
+
     # so this function will take in a current keyword and search the columns for this keyword and return matches
     def search_table(self, current: str, cols: list = None):
         if not cols:
@@ -118,17 +174,27 @@ class BaseTable:
 class VariableTable(BaseTable):
 
     def __init__(self, conn: sqlite3.Connection):
-        cols = ('variable_id', 'category_id', 'var_name', 'var_values')
-        col_types = ('VARCHAR(25) PRIMARY KEY', 'VARCHAR(25)', 'VARCHAR(25)', 'json')
+        cols = ('variable_id', 'category_id', 'var_name', 'var_values', 'is_subcategory')
+        col_types = ('VARCHAR(25) PRIMARY KEY', 'VARCHAR(25)', 'VARCHAR(25)', 'json', 'INTEGER')
         name = 'variables'
         primary_key = 'variable_id'
         super().__init__(conn, name, cols, col_types, primary_key)
 
 
+# sql for the subcategory of a run: the values of its variables that split the leaderboard (is_subcategory), sorted
+# so two runs in the same subcategory always get the same text. variable_id_col is the variable_id column of
+# runs_master ({variable_id: value_id}). anything else in variable_info (like a platform that isn't a subcategory)
+# is left out, so it can be grouped on or compared
+def subcategory_sql(variable_id_col: str) -> str:
+    return f'''(SELECT group_concat(key || '=' || value) FROM (
+        SELECT vars.key, vars.value FROM json_each({variable_id_col}) vars
+        JOIN variables v ON v.variable_id = vars.key WHERE v.is_subcategory IS NOT 0 ORDER BY vars.key))'''
+
+
 class CategoryTable(BaseTable):
     def __init__(self, conn: sqlite3.Connection):
-        cols = ('category_id', 'name', 'game_id')
-        col_types = ('VARCHAR(25) PRIMARY KEY', 'VARCHAR(25)', 'VARCHAR(25)')
+        cols = ('category_id', 'name', 'game_id', 'category_type')
+        col_types = ('VARCHAR(25) PRIMARY KEY', 'VARCHAR(25)', 'VARCHAR(25)', 'VARCHAR(25)')
         name = 'categories'
         primary_key = 'category_id'
         super().__init__(conn, name, cols, col_types, primary_key)
@@ -190,7 +256,67 @@ class MasterTable(BaseTable):
         )
         name = 'runs_master'
         primary_key = 'run_id'
-        super().__init__(conn, name, cols, col_types, primary_key)
+        # date filters from where.create_where_conditions_from_date_str are ranges on run_date,
+        # and select_page walks a category in (igt, run_id) order
+        indexes = (('run_date',), ('game_name', 'category_name', 'igt', 'run_id'))
+        super().__init__(conn, name, cols, col_types, primary_key, indexes)
+
+    # counts the rows matching where_conds without pulling them out of the table
+    def count_rows(self, where_conds: list = None) -> int:
+        row = next(iter(self.select_row_col(cols=['COUNT(*) AS num'], where_conds=where_conds)), {})
+        return row.get('num', 0)
+
+    # keyset pagination in (igt, run_id) order, so getting a page never has to skip over the pages before it.
+    # after is the (igt, run_id) of the last row on the current page, before is the (igt, run_id) of the first row.
+    # cols has to include igt and run_id so the caller can get the keys for the next page
+    def select_page(self, cols: list, where_conds: list = None, after: tuple = None, before: tuple = None,
+                    limit: int = 10):
+        where_conds = [*(where_conds if where_conds else []), WhereCond('igt', 'IS NOT', None)]
+        order_by = ['igt', 'run_id']
+        if after:
+            where_conds.append(WhereCond(('igt', 'run_id'), '>', after))
+        elif before:
+            where_conds.append(WhereCond(('igt', 'run_id'), '<', before))
+            order_by = ['igt DESC', 'run_id DESC']
+        rows = self.select_row_col(cols=cols, where_conds=where_conds, order_by=order_by, limit=limit)
+        return rows[::-1] if before and not after else rows
+
+    # run_ids of the rows that aren't in the table yet or are different from what's there. the rows go into a temp
+    # table first, so they're compared the way they'd be stored (after the adapters run) in one query
+    def get_changed_run_ids(self, rows: list) -> set:
+        cols = tuple(f'{col} {col_type}' for col, col_type in zip(self.COLS, self.COL_TYPES))
+        self('DROP TABLE IF EXISTS temp.runs_incoming')
+        self(f'''CREATE TEMP TABLE runs_incoming ({', '.join(cols)})''')
+        self.executemany(f'''INSERT INTO temp.runs_incoming VALUES ({', '.join(['?' for _ in self.COLS])})''', rows)
+        # json is compared by its content, since the same value can be written with different spacing
+        differs = ' OR '.join(f'json(m.{col}) IS NOT json(i.{col})' if col_type in ('json', 'users')
+                              else f'm.{col} IS NOT i.{col}' for col, col_type in zip(self.COLS, self.COL_TYPES))
+        query = f'''
+        SELECT DISTINCT i.run_id FROM temp.runs_incoming i LEFT JOIN {self.NAME} m ON m.run_id = i.run_id
+        WHERE m.run_id IS NULL OR {differs}'''
+        changed = self(query)
+        self('DROP TABLE temp.runs_incoming')
+        return {row.get('run_id') for row in changed}
+
+    # a full resync writes runs before it knows every user, so the verifier id of each run goes into a temp table
+    # (add_verifiers) as it's written, and resolve_verifiers fills in verifier_info and verifier_name at the end
+    def create_verifiers_table(self):
+        self('DROP TABLE IF EXISTS temp.run_verifiers')
+        self('CREATE TEMP TABLE run_verifiers (run_id VARCHAR(25) PRIMARY KEY, verifier_id VARCHAR(25))')
+
+    def add_verifiers(self, rows: list):
+        self.executemany('INSERT OR IGNORE INTO temp.run_verifiers VALUES (?, ?)', rows)
+
+    # verifier_info is the same json as users.Users, {user_id: the rest of their users row}
+    def resolve_verifiers(self, user_table: UserTable):
+        self(f'''
+        UPDATE {self.NAME} SET
+            verifier_info = json_object(u.user_id, json_object('user_name', u.user_name, 'pronouns', u.pronouns,
+                                                               'user_type', u.user_type, 'user_pfp', u.user_pfp)),
+            verifier_name = u.user_name
+        FROM temp.run_verifiers v JOIN {user_table.NAME} u ON u.user_id = v.verifier_id
+        WHERE {self.NAME}.run_id = v.run_id''')
+        self('DROP TABLE temp.run_verifiers')
 
     def get_embed_attributes_from_run_id(self, run_id, format_time_func):
         selected_cols = ['game_name', 'player_info', 'run_date', 'run_video', 'comment', 'rta', 'igt', 'category_name',
@@ -219,12 +345,107 @@ class MasterTable(BaseTable):
         return {'title': title, 'description': description, 'video_url': video_url, 'profile_picture': profile_picture}
 
 
-def drop_all_tables(conn: sqlite3.Connection):
-    cursor = conn.cursor()
-    names = cursor.execute('SELECT name FROM sqlite_master').fetchall()
-    [cursor.execute(f'DROP TABLE {row_dict.get("name")}') for row_dict in names if not row_dict.get('name').startswith('sqlite')]
-    conn.commit()
-    return
+# one row per player per run, so everything about a runner can be found through an index instead of going through
+# player_info in every row of runs_master. user_id is the same id the users table uses
+class RunPlayersTable(BaseTable):
+    def __init__(self, conn: sqlite3.Connection):
+        cols = ('run_id', 'user_id', 'game_name', 'category_name', 'variable_info', 'igt', 'status')
+        col_types = ('VARCHAR(25)', 'VARCHAR(25)', 'VARCHAR(25)', 'VARCHAR(25)', 'json', 'REAL', 'VARCHAR(25)')
+        name = 'run_players'
+        # there's a row per player of a run, so nothing is unique. upserts go by run_id (see upsert_rows)
+        indexes = (('user_id', 'status', 'game_name', 'category_name', 'variable_info', 'igt'), ('run_id',))
+        super().__init__(conn, name, cols, col_types, indexes=indexes)
+
+    # a db from before this table existed only has runs_master, so if this is empty it's filled from there,
+    # with one row per player (the keys of player_info)
+    def backfill(self, master_table: MasterTable):
+        if next(iter(self(f'''SELECT EXISTS (SELECT 1 FROM {self.NAME}) AS has_rows''')), {}).get('has_rows'):
+            return
+        self(f'''
+        INSERT INTO {self.NAME} ({', '.join(self.COLS)})
+        SELECT m.run_id, players.key, m.game_name, m.category_name, m.variable_info, m.igt, m.status
+        FROM {master_table.NAME} m, json_each(m.player_info) players''')
+
+    # fastest verified run in each category/subcategory for a runner. sqlite takes run_id from the row with the MIN.
+    # runs are grouped by subcategory_sql, which needs the variable ids from runs_master
+    def get_personal_bests(self, user_id: str, master_table: MasterTable):
+        query = f'''SELECT p.game_name, p.category_name, p.variable_info, p.run_id, MIN(p.igt) AS igt FROM {self.NAME} p
+        JOIN {master_table.NAME} m ON m.run_id = p.run_id WHERE p.user_id = ? AND p.status = ?
+        GROUP BY p.game_name, p.category_name, {subcategory_sql('m.variable_id')} ORDER BY p.game_name, p.category_name'''
+        return self(query, (user_id, 'verified'))
+
+    # number of runs (of any status), number of verified runs and total verified time for a runner
+    def get_runner_totals(self, user_id: str) -> dict:
+        query = f'''SELECT COUNT(*) AS num_runs, SUM(status = ?) AS num_verified,
+        TOTAL(CASE WHEN status = ? THEN igt END) AS total_time FROM {self.NAME} WHERE user_id = ?'''
+        return next(iter(self(query, ('verified', 'verified', user_id))), {})
+
+
+# a log of runs that got submitted, verified or rejected (and whether that made them the new wr), worked out by
+# comparing runs_master before and after a sync. notified is set once the change has been posted to discord
+class RunChangesTable(BaseTable):
+    def __init__(self, conn: sqlite3.Connection):
+        cols = ('change_id', 'run_id', 'game_name', 'category_name', 'variable_info', 'player_name', 'igt',
+                'old_status', 'new_status', 'is_new_wr', 'changed_at', 'notified')
+        col_types = ('INTEGER PRIMARY KEY', 'VARCHAR(25)', 'VARCHAR(25)', 'VARCHAR(25)', 'json', 'VARCHAR(25)', 'REAL',
+                     'VARCHAR(25)', 'VARCHAR(25)', 'INTEGER', 'TEXT', 'INTEGER DEFAULT 0')
+        name = 'run_changes'
+        primary_key = 'change_id'
+        indexes = (('notified', 'change_id'),)
+        super().__init__(conn, name, cols, col_types, primary_key, indexes)
+
+    # saves the status of runs before a sync into a temp table for record_changes to compare against.
+    # run_ids limits it to the runs that are about to be written (for upserts), otherwise it's every run
+    def snapshot_statuses(self, master_table: MasterTable, run_ids: list = None):
+        self('DROP TABLE IF EXISTS temp.runs_previous')
+        self('CREATE TEMP TABLE runs_previous (run_id VARCHAR(25) PRIMARY KEY, status VARCHAR(25))')
+        if run_ids is None:
+            self(f'INSERT INTO temp.runs_previous SELECT run_id, status FROM {master_table.NAME} GROUP BY run_id')
+            return
+        previous = {row.get('run_id'): row.get('status')
+                    for row in master_table.select_rows_in('run_id', run_ids, cols=['run_id', 'status'])}
+        # runs that weren't there before go in with no status, so they count as new
+        self.executemany('INSERT OR IGNORE INTO temp.runs_previous VALUES (?, ?)',
+                         [(run_id, previous.get(run_id)) for run_id in run_ids])
+
+    # logs every run whose status is different from the snapshot, in one query. if the snapshot was of every run,
+    # runs missing from it are new. a run is a new wr if it's verified and no verified run in its subcategory
+    # (see subcategory_sql) is faster
+    def record_changes(self, master_table: MasterTable, full: bool = False):
+        if full and not next(iter(self('SELECT COUNT(*) AS num FROM temp.runs_previous')), {}).get('num'):
+            # the first sync of an empty db isn't a change, every run would be new
+            return self('DROP TABLE IF EXISTS temp.runs_previous')
+        query = f'''
+        INSERT INTO {self.NAME} (run_id, game_name, category_name, variable_info, player_name, igt, old_status, new_status,
+                                 is_new_wr, changed_at)
+        SELECT m.run_id, m.game_name, m.category_name, m.variable_info, m.player_name, m.igt, p.status, m.status,
+            m.status = 'verified' AND m.igt IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM {master_table.NAME} w WHERE w.game_name = m.game_name AND w.category_name = m.category_name
+                AND {subcategory_sql('w.variable_id')} IS {subcategory_sql('m.variable_id')} AND w.status = 'verified'
+                AND w.igt < m.igt
+            ), datetime('now')
+        FROM {master_table.NAME} m LEFT JOIN temp.runs_previous p ON p.run_id = m.run_id
+        WHERE (p.run_id IS NULL AND ?) OR (p.run_id IS NOT NULL AND p.status IS NOT m.status)'''
+        data = self(query, (full,))
+        self('DROP TABLE IF EXISTS temp.runs_previous')
+        return data
+
+    def get_unnotified(self, limit: int = 500):
+        return self.select_row_col(where_conds=[WhereCond('notified', '=', 0)], order_by=['change_id'], limit=limit)
+
+    def set_notified(self, change_ids: list):
+        for batch in where.batch_values(change_ids):
+            self(f'''UPDATE {self.NAME} SET notified = 1 WHERE {where.format_cond('change_id', 'IN', None, len(batch))}''',
+                 tuple(batch))
+
+
+# copies the whole db into an in memory db, so reads can be served without touching the disk.
+# calling conn.backup(replica) again later brings the replica up to date
+def create_memory_replica(conn: sqlite3.Connection, cached_statements: int = 128) -> sqlite3.Connection:
+    replica = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=cached_statements)
+    replica.row_factory = dict_factory
+    conn.backup(replica)
+    return replica
 
 
 # this is for sqlite3 connection to transform rows into dictionaries
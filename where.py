@@ -1,5 +1,6 @@
 import datetime
-from re import findall
+from functools import lru_cache
+from re import compile as compile_regex
 # a problem came up with select row col that im going to solve with a custom where condition class
 # this class represents an argument to where. it has 3 variables
 
@@ -12,50 +13,192 @@ class WhereCond:
         self.col_mod = col_mod
 
     def __call__(self):
-        return f'{self.col_mod}({self.col}) {self.operator} ?' if self.col_mod else f'{self.col} {self.operator} ?'
+        return format_cond(*self.shape())
 
     def __repr__(self):
         return f'{self.col}, {self.operator}, {self.value}, {self.col_mod}'
 
+    # IN conditions and row value comparisons like (igt, run_id) > (?, ?) (col is a tuple) take a sequence of values
+    def is_batch(self) -> bool:
+        return self.operator.upper() in ('IN', 'NOT IN') or isinstance(self.col, tuple)
+
+    def params(self) -> tuple:
+        return tuple(self.value) if self.is_batch() else (self.value,)
+
+    # two conditions with the same shape produce the same sql, only their params differ
+    def shape(self) -> tuple:
+        return self.col, self.operator, self.col_mod, len(self.value) if self.is_batch() else None
+
+
+# this should match cached_statements on the sqlite connection, so every sql string we build can stay prepared
+STATEMENT_CACHE_SIZE = 256
+# sqlite's default limit on ? in one statement is 999, so IN lookups are split into batches smaller than that
+MAX_BATCH_SIZE = 512
+
+
+def format_cond(col: str or tuple, operator: str, col_mod: str = None, num_values: int = None) -> str:
+    if isinstance(col, tuple):
+        col = f'''({', '.join(col)})'''
+    col = f'{col_mod}({col})' if col_mod else col
+    if num_values is not None:
+        return f'''{col} {operator} ({', '.join(['?'] * num_values)})'''
+    return f'{col} {operator} ?'
+
+
+# builds the sql text for a select from the shape of the query alone, so the same filters always give back the
+# exact same string (and sqlite can reuse the prepared statement instead of parsing it again)
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def build_select_sql(table: str, cols: tuple, cond_shapes: tuple, order_by: tuple = (), has_limit: bool = False) -> str:
+    query = f'''SELECT {', '.join(cols)} FROM {table}'''
+    if cond_shapes:
+        query += f''' WHERE {' AND '.join(format_cond(*shape) for shape in cond_shapes)}'''
+    if order_by:
+        query += f''' ORDER BY {', '.join(order_by)}'''
+    if has_limit:
+        query += ' LIMIT ?'
+    return query
+
+
+# returns the sql and params for a select. limit is a param rather than part of the sql so it doesn't change the shape
+def build_select(table: str, cols: list = None, where_conds: list = None, order_by: list = None,
+                 limit: int = None) -> tuple:
+    cols = tuple(cols) if cols else ('*',)
+    where_conds = where_conds if where_conds else []
+    cond_shapes = tuple(where_cond.shape() for where_cond in where_conds)
+    query = build_select_sql(table, cols, cond_shapes, tuple(order_by) if order_by else (), limit is not None)
+    params = tuple(param for where_cond in where_conds for param in where_cond.params())
+    if limit is not None:
+        params += (limit,)
+    return query, params
+
+
+# splits values into batches for IN lookups. batches get padded up to a power of 2 (by repeating the last value,
+# which doesn't change what IN matches) so there are only a handful of different statement shapes
+def batch_values(values, max_batch: int = MAX_BATCH_SIZE) -> list:
+    values = list(dict.fromkeys(values))
+    batches = []
+    for start in range(0, len(values), max_batch):
+        batch = values[start:start + max_batch]
+        padded_size = min(max(8, 1 << (len(batch) - 1).bit_length()), max_batch)
+        batches.append(batch + batch[-1:] * (padded_size - len(batch)))
+    return batches
+
+
+# regex of iso8601 dates is \d\d\d\d-\d\d-\d\d
+DATE_REGEX = compile_regex(r'\d{4}-\d{2}-\d{2}')
+LAST_REGEX = compile_regex(r'^last\s+(\d+)\s+(day|week|month|year)s?$')
+YEAR_REGEX = compile_regex(r'^year\s+(\d{4})$')
+DATE_COL = 'run_date'
+
 
 def get_dates_from_str(string: str):
-    # regex of iso8401 dates is /d/d/d/d-/d/d-/d/d
-    return findall('/d/d/d/d-/d/d-/d/d', string)
-
-
-def create_where_conditions_from_date_str(date_str: str) -> tuple:
-    keyword = date_str.lower().split(' ')[0]
-    normal_keyword_values = {
-        'after': 'date > {}',
-        'before': 'date < {}',
-        'on': 'date = {}',
-        'between': '{} > date;{} < date',
-    }
-    if keyword in normal_keyword_values:
-        dates = get_dates_from_str(date_str)
-        if not dates:
-            raise ValueError('error: date not in correct format')
-        where_cond_tuple = tuple(map(lambda x: x.split(' '), normal_keyword_values[keyword].format(dates).split(';')))
-        where_conds = tuple(WhereCond(cond[0], cond[1], cond[2]) for cond in where_cond_tuple)
-        return where_conds
-    elif keyword == 'last':
-        date = datetime.date.fromisoformat(get_dates_from_str(date_str)[0])
-        num = int(date_str.split(' ')[1])
-        if 'days' in date_str:
-            return (WhereCond('date', '>', date - datetime.timedelta(days=num)),)
-        elif 'weeks' in date_str:
-            return (WhereCond('date', '>', date - datetime.timedelta(weeks=num)),)
-        elif 'months' in date_str:
-            return (WhereCond('date', '>', date - datetime.timedelta(days=num*30)),)
-        elif 'years' in date_str:
-            return (WhereCond('date', '>', date - datetime.timedelta(days=num*365)),)
+    return [datetime.date.fromisoformat(date_str) for date_str in DATE_REGEX.findall(string)]
+
+
+# the date filters get parsed into one of these nodes before being turned into sql.
+# every node boils down to a half open range start <= run_date < end, so run_date can use its index.
+# start/end of None means that side of the range is open
+class DateRange:
+    def __init__(self, start: datetime.date = None, end: datetime.date = None):
+        self.start = start
+        self.end = end
+
+    def __call__(self, col: str = DATE_COL) -> tuple:
+        conditions = []
+        if self.start:
+            conditions.append(WhereCond(col, '>=', self.start))
+        if self.end:
+            conditions.append(WhereCond(col, '<', self.end))
+        return tuple(conditions)
+
+    def __repr__(self):
+        return f'{self.start}, {self.end}'
+
+    # (start, end) for anything that wants the range itself instead of WhereConds
+    def bounds(self, today: datetime.date = None) -> tuple:
+        return self.start, self.end
+
+
+# "last # days" is relative to today, so it can't be turned into a range until we know what today is
+class RelativeDateRange:
+    def __init__(self, num: int, unit: str):
+        self.num = num
+        self.unit = unit
+
+    def __call__(self, col: str = DATE_COL, today: datetime.date = None) -> tuple:
+        return DateRange(*self.bounds(today))(col)
+
+    def bounds(self, today: datetime.date = None) -> tuple:
+        today = today if today else datetime.date.today()
+        if self.unit == 'day':
+            start = subtract_days(today, self.num)
+        elif self.unit == 'week':
+            start = subtract_days(today, self.num * 7)
+        elif self.unit == 'month':
+            start = subtract_months(today, self.num)
         else:
-            raise ValueError('error: date not in correct format')
-    elif keyword == 'year':
-        year = findall('/d/d/d/d', date_str)
-        if not year:
-            raise ValueError('error: date not in correct format')
-        conditions = (f'date >= 01-01-{year}', f'date <= 12-31-{year}')
-        return tuple(WhereCond(cond[0], cond[1], cond[2]) for cond in conditions)
-    else:
-        raise ValueError('error: date not in correct format')
\ No newline at end of file
+            start = subtract_months(today, self.num * 12)
+        return start, today + datetime.timedelta(days=1)
+
+    def __repr__(self):
+        return f'last {self.num} {self.unit}'
+
+
+# goes back a number of days, anything before the first date there is just the first date (like subtract_months)
+def subtract_days(day: datetime.date, days: int) -> datetime.date:
+    if days >= (day - datetime.date.min).days:
+        return datetime.date.min
+    return day - datetime.timedelta(days=days)
+
+
+# goes back a number of calendar months, clamping the day (so mar 31 - 1 month is feb 28/29)
+def subtract_months(day: datetime.date, months: int) -> datetime.date:
+    month_index = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month_index, 12)
+    if year < datetime.MINYEAR:
+        return datetime.date.min
+    next_month = datetime.date(year + (month + 1) // 12, (month + 1) % 12 + 1, 1)
+    last_day = (next_month - datetime.timedelta(days=1)).day
+    return datetime.date(year, month + 1, min(day.day, last_day))
+
+
+def next_day(day: datetime.date) -> datetime.date:
+    return day + datetime.timedelta(days=1)
+
+
+# turns the strings from ac.get_date into a DateRange or RelativeDateRange.
+# the same few strings get typed over and over, so the parsed form is cached
+@lru_cache(maxsize=256)
+def parse_date_str(date_str: str) -> DateRange or RelativeDateRange:
+    date_str = ' '.join(date_str.lower().split())
+    keyword = date_str.split(' ')[0]
+    try:
+        if keyword in ('after', 'before', 'on', 'between'):
+            dates = get_dates_from_str(date_str)
+            if keyword == 'between' and len(dates) == 2:
+                first, last = sorted(dates)
+                return DateRange(first, next_day(last))
+            if keyword != 'between' and len(dates) == 1:
+                date = dates[0]
+                if keyword == 'after':
+                    return DateRange(next_day(date), None)
+                if keyword == 'before':
+                    return DateRange(None, date)
+                return DateRange(date, next_day(date))
+        elif keyword == 'last':
+            match = LAST_REGEX.match(date_str)
+            if match:
+                return RelativeDateRange(int(match.group(1)), match.group(2))
+        elif keyword == 'year':
+            match = YEAR_REGEX.match(date_str)
+            if match:
+                year = int(match.group(1))
+                return DateRange(datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1))
+    except (ValueError, OverflowError):
+        pass
+    raise ValueError('error: date not in correct format')
+
+
+# returns a tuple of WhereConds that can be passed straight into select_row_col
+def create_where_conditions_from_date_str(date_str: str, col: str = DATE_COL) -> tuple:
+    return parse_date_str(date_str)(col)